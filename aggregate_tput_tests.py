@@ -1,10 +1,12 @@
 import argparse
+from functools import partial
 import pandas as pd
 import numpy as np
 import write_csv
 from pathlib import Path
 import logging
 import sys
+import table_schema
 
 
 def dbm_to_mw(dbm):
@@ -15,163 +17,187 @@ def mw_to_dbm(mw):
     return 10 * np.log10(mw)
 
 
-def write(df, args):
-    if args.json:
-        df.to_json(args.output_file, orient="split")
-    else:
-        df.to_csv(args.output_file)
+# Columns of each interface's tput line, suffixed by the interface name
+tput_cols = ["host", "mean_tput_mbps", "std_tput_mbps", "min_tput_mbps",
+             "max_tput_mbps", "median_tput_mbps"]
+# Columns of the connected AP's scan line
+conn_ap_cols = ["active_wlan", "rssi_dbm", "primary_freq_mhz",
+                "center_freq_mhz", "min_freq_mhz", "max_freq_mhz", "bw_mhz",
+                "amendment", "tx_power_dbm", "link_margin_db", "sta_count",
+                "ch_utilization", "available_admission_capacity_sec",
+                "link_mean_rssi_dbm", "link_max_rssi_dbm",
+                "link_min_rssi_dbm", "link_median_rssi_dbm",
+                "link_mean_tx_bitrate_mbps", "link_max_tx_bitrate_mbps",
+                "link_min_tx_bitrate_mbps", "link_median_tx_bitrate_mbps",
+                "link_mean_rx_bitrate_mbps", "link_max_rx_bitrate_mbps",
+                "link_min_rx_bitrate_mbps", "link_median_rx_bitrate_mbps"]
+
+
+def with_nan_strings(df):
+    # Missing numbers of the parsed lines are written as "NaN" strings like
+    # in the throughput and wifi_scan tables, while the columns of an
+    # interface without a test or of a test without a connected AP are left
+    # empty. The first column of each group tells if its line exists.
+    ifaces = [col[len("host_"):] for col in df.columns
+              if col.startswith("host_")]
+    groups = [[f"{col}_{iface}" for col in tput_cols] for iface in ifaces]
+    groups.append(conn_ap_cols)
+    out_df = df.copy(deep=False)
+    for cols in groups:
+        if cols[0] not in df.columns:
+            continue
+        has_line = df[cols[0]].notna()
+        for col in cols[1:]:
+            nan_mask = has_line & df[col].isna()
+            if nan_mask.any():
+                out_df[col] = df[col].astype(object).mask(nan_mask, "NaN")
+    return out_df
+
+
+def write_file(df, fmt, output_file):
+    match fmt:
+        case "json":
+            with_nan_strings(df).to_json(output_file, orient="split")
+        case "parquet":
+            table_schema.write_parquet([df], "agg_tput", output_file)
+        case _:
+            with_nan_strings(df).to_csv(output_file)
+
+
+def write_files(df, outputs):
+    # Write df to each {fmt: path} of outputs concurrently
+    table_schema.write_outputs(partial(write_file, df), outputs)
 
 
-def join_overlap(df_main, df_scan, col_prefix, overlap_fun):
-    overlap_indices = overlap_fun(df_scan)
-    logging.info(df_scan[overlap_indices])
-
-    # Join neighboring APs' RSSI statistics
-    overlap_group_rssi = df_scan[overlap_indices].groupby(
-        "test_uuid_concat")["rssi_dbm"]
-    df_main = df_main.join(overlap_group_rssi.count().rename(
-        f"{col_prefix}_count"), on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_rssi.apply(
-        lambda x: mw_to_dbm(dbm_to_mw(x).mean())).rename(
-            f"{col_prefix}_mean_rssi_dbm"),
-        on="test_uuid_concat")
-    # df_main = df_main.join(overlap_group_rssi.apply(
-    #     lambda x: mw_to_dbm(dbm_to_mw(x).std())).rename(
-    #     f"{col_prefix}_std_rssi_dbm"),
-    #     on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_rssi.median().rename(
-        f"{col_prefix}_median_rssi_dbm"), on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_rssi.min().rename(
-            f"{col_prefix}_min_rssi_dbm"),
-        on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_rssi.max().rename(
-            f"{col_prefix}_max_rssi_dbm"),
+def write(df, args):
+    write_file(df, table_schema.get_format(args), args.output_file)
+
+
+def get_overlaps(out_scan):
+    # Pair each neighboring AP with the connected APs of its test and check
+    # if their channels overlap, on the full channel and on the primary
+    # channel. Only the frequency intervals are compared, the other columns
+    # of the connected APs are not copied to the neighboring APs.
+    # Returns the paired neighboring APs' columns used for the statistics
+    # and the masks of full and primary overlap.
+    connected = out_scan["connected"].to_numpy()
+    conn = out_scan[connected]
+    neighbors = out_scan[~connected]
+
+    # Positions of the pairs, in the order of the neighboring APs
+    pairs = pd.DataFrame({
+        "test_uuid_concat": neighbors.index,
+        "neighbor": np.arange(len(neighbors))}).merge(
+        pd.DataFrame({
+            "test_uuid_concat": conn.index,
+            "conn": np.arange(len(conn))}),
         on="test_uuid_concat")
-
-    # Prepare group for optional beacon elements
-    overlap_group = df_scan[overlap_indices][[
-        "tx_power_dbm", "sta_count", "ch_utilization"]]
-    overlap_group = overlap_group.astype(
+    neighbor_pos = pairs["neighbor"].to_numpy()
+    conn_pos = pairs["conn"].to_numpy()
+
+    def overlap(min_col, max_col):
+        neighbor_min = neighbors[min_col].to_numpy()[neighbor_pos]
+        neighbor_max = neighbors[max_col].to_numpy()[neighbor_pos]
+        conn_min = conn[min_col].to_numpy()[conn_pos]
+        conn_max = conn[max_col].to_numpy()[conn_pos]
+        return (conn_min <= neighbor_max) & (neighbor_min <= conn_max)
+
+    df_overlap = neighbors[[
+        "rssi_dbm", "tx_power_dbm", "sta_count", "ch_utilization"]].iloc[
+        neighbor_pos]
+    return (df_overlap,
+            overlap("min_freq_mhz", "max_freq_mhz"),
+            overlap("primary_min_freq_mhz", "primary_max_freq_mhz"))
+
+
+def get_group_means(values, keys):
+    # Mean of the values of each key, sorted by key. Each group is summed as
+    # one contiguous array like Series.mean does, groupby().mean() sums in
+    # another order and can differ in the last digit.
+    codes, uniques = pd.factorize(keys, sort=True)
+    values = np.asarray(values)[np.argsort(codes, kind="stable")]
+    counts = np.bincount(codes, minlength=len(uniques))
+    ends = np.cumsum(counts)
+    sums = [values[end - count:end].sum()
+            for end, count in zip(ends, counts)]
+    return pd.Series(np.array(sums, dtype=float) / counts, index=uniques)
+
+
+def join_overlap(df_main, df_overlap, col_prefix):
+    # Join the statistics of the neighboring APs in df_overlap to each test
+    logging.info(df_overlap)
+
+    # Prepare neighboring APs, optional beacon elements are NaN if missing
+    df_overlap = df_overlap.astype(
         {"tx_power_dbm": float, "sta_count": float, "ch_utilization": float})
 
-    # Join neighboring APs' TX power statistics
-    overlap_group_tx_power = overlap_group[["tx_power_dbm"]].dropna().groupby(
-        "test_uuid_concat")["tx_power_dbm"]
-    df_main = df_main.join(overlap_group_tx_power.count().rename(
-        f"{col_prefix}_num_bssid_with_power_elem"),
-        on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_tx_power.mean().rename(
-        f"{col_prefix}_mean_tx_power_dbm"),
-        on="test_uuid_concat")
-    # df_main = df_main.join(overlap_group_tx_power.std().rename(
-    #     f"{col_prefix}_std_tx_power_dbm"),
-    #     on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_tx_power.median().rename(
-        f"{col_prefix}_median_tx_power_dbm"), on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_tx_power.min().rename(
-            f"{col_prefix}_min_tx_power_dbm"),
-        on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_tx_power.max().rename(
-            f"{col_prefix}_max_tx_power_dbm"),
-        on="test_uuid_concat")
-
-    # Join neighboring APs' CH util statistics
-    overlap_group_ch_util = overlap_group[["ch_utilization"]].dropna().groupby(
-        "test_uuid_concat")["ch_utilization"]
-    df_main = df_main.join(overlap_group_ch_util.count().rename(
-        f"{col_prefix}_num_bssid_with_load_elem"),
-        on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_ch_util.mean().rename(
-        f"{col_prefix}_mean_ch_utilization"),
-        on="test_uuid_concat")
-    # df_main = df_main.join(overlap_group_ch_util.std().rename(
-    #     f"{col_prefix}_std_ch_utilization"),
-    #     on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_ch_util.median().rename(
-        f"{col_prefix}_median_ch_utilization"), on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_ch_util.min().rename(
-            f"{col_prefix}_min_ch_utilization"),
-        on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_ch_util.max().rename(
-            f"{col_prefix}_max_ch_utilization"),
-        on="test_uuid_concat")
-
-    # Join neighboring APs' STA count statistics
-    overlap_group_sta_count = overlap_group[["sta_count"]].dropna().groupby(
-        "test_uuid_concat")["sta_count"]
-    df_main = df_main.join(overlap_group_sta_count.mean().rename(
-        f"{col_prefix}_mean_sta_count"),
-        on="test_uuid_concat")
-    # df_main = df_main.join(overlap_group_sta_count.std().rename(
-    #     f"{col_prefix}_std_sta_count"),
-    #     on="test_uuid_concat")
-    df_main = df_main.join(overlap_group_sta_count.median().rename(
-        f"{col_prefix}_median_sta_count"), on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_sta_count.min().rename(
-            f"{col_prefix}_min_sta_count"),
-        on="test_uuid_concat")
-    df_main = df_main.join(
-        overlap_group_sta_count.max().rename(
-            f"{col_prefix}_max_sta_count"),
-        on="test_uuid_concat")
-
-    return df_main
+    # Neighboring APs' statistics of each test, in the order of the columns
+    agg_cols = {
+        "count": ("rssi_dbm", "count"),
+        "median_rssi_dbm": ("rssi_dbm", "median"),
+        "min_rssi_dbm": ("rssi_dbm", "min"),
+        "max_rssi_dbm": ("rssi_dbm", "max"),
+        "num_bssid_with_power_elem": ("tx_power_dbm", "count")}
+    for col in ["tx_power_dbm", "ch_utilization", "sta_count"]:
+        if col == "ch_utilization":
+            agg_cols["num_bssid_with_load_elem"] = (col, "count")
+        for stat in ["mean", "median", "min", "max"]:
+            agg_cols[f"{stat}_{col}"] = (col, stat)
+    overlap_stats = df_overlap.groupby("test_uuid_concat").agg(**agg_cols)
+    # RSSI is averaged in mW
+    overlap_stats.insert(1, "mean_rssi_dbm", mw_to_dbm(get_group_means(
+        dbm_to_mw(df_overlap["rssi_dbm"]), df_overlap.index)))
+    # Tests where no neighboring AP sent the element have no statistics
+    for col in ["num_bssid_with_power_elem", "num_bssid_with_load_elem"]:
+        overlap_stats[col] = overlap_stats[col].where(overlap_stats[col] > 0)
+
+    return df_main.join(overlap_stats.add_prefix(f"{col_prefix}_"),
+                        on="test_uuid_concat")
+
+
+def coalesce(df):
+    # First non-missing value of each row, in the order of the columns
+    out = df.iloc[:, 0]
+    for col in df.columns[1:]:
+        out = out.fillna(df[col])
+    return out
 
 
 def create_tput_df(tput_dict):
     # Tput DF
-    out_tput = pd.DataFrame.from_dict(tput_dict)
+    out_tput = write_csv.to_frame(tput_dict, "throughput")
     out_tput = out_tput[out_tput["test_uuid"] != "unknown"]
     if (out_tput.shape[0] == 0):
         logging.warning("Tput table empty after filtering!")
         return
 
     out_tput = out_tput.rename(columns={"tput_mbps": "mean_tput_mbps"})
-    out_tput["direction"] = out_tput["direction"].map(
-        lambda x: "dl" if x == "downlink" else "ul")
+    out_tput["direction"] = np.where(
+        out_tput["direction"] == "downlink", "dl", "ul")
     # Include type and direction on the uuid
-    out_tput["test_uuid_concat"] = out_tput[[
-        "test_uuid", "type", "direction"]].apply(lambda x: '-'.join(x), axis=1)
-    out_tput["type_dir"] = out_tput[[
-        "type", "direction"]].apply(lambda x: '-'.join(x), axis=1)
+    out_tput["type_dir"] = (
+        out_tput["type"].astype(str) + "-" + out_tput["direction"])
+    out_tput["test_uuid_concat"] = (
+        out_tput["test_uuid"] + "-" + out_tput["type_dir"])
     logging.info(out_tput["test_uuid_concat"])
 
     # Pivot tput data based on the interface
     combined = out_tput.pivot(
         index="test_uuid_concat",
         columns="interface",
-        values=["timestamp", "type_dir", "host", "mean_tput_mbps",
-                "std_tput_mbps", "min_tput_mbps", "max_tput_mbps",
-                "median_tput_mbps"])
+        values=["timestamp", "type_dir"] + tput_cols)
+    interfaces = list(combined.columns.unique(level=1))
     combined.columns = ['_'.join(col) for col in combined.columns]
     # combined = combined[combined["mean_tput_mbps_wlan0"] > 0]
-    combined.insert(0, "timestamp", None)
-    combined.insert(1, "type", None)
-    if "timestamp_eth0" in combined:
-        combined["timestamp"] = combined["timestamp"].fillna(
-            combined["timestamp_eth0"])
-        combined["type"] = combined["type"].fillna(
-            combined["type_dir_eth0"])
-        combined = combined.drop(["type_dir_eth0", "timestamp_eth0"], axis=1)
-    if "timestamp_wlan0" in combined:
-        combined["timestamp"] = combined["timestamp"].fillna(
-            combined["timestamp_wlan0"])
-        combined["type"] = combined["type"].fillna(
-            combined["type_dir_wlan0"])
-        combined = combined.drop(["type_dir_wlan0", "timestamp_wlan0"], axis=1)
-    if "timestamp_wlan1" in combined:
-        combined["timestamp"] = combined["timestamp"].fillna(
-            combined["timestamp_wlan1"])
-        combined["type"] = combined["type"].fillna(
-            combined["type_dir_wlan1"])
-        combined = combined.drop(["type_dir_wlan1", "timestamp_wlan1"], axis=1)
+
+    # Take the timestamp and type of the first interface that ran the test,
+    # as objects so tests with the same timestamp keep their sorted order
+    timestamp_cols = [f"timestamp_{iface}" for iface in interfaces]
+    type_cols = [f"type_dir_{iface}" for iface in interfaces]
+    combined.insert(0, "timestamp",
+                    coalesce(combined[timestamp_cols]).astype(object))
+    combined.insert(1, "type", coalesce(combined[type_cols]).astype(object))
+    combined = combined.drop(timestamp_cols + type_cols, axis=1)
     logging.info(combined)
 
     return combined
@@ -182,8 +208,11 @@ def create_csv(tput_dict, wifi_scan_dict):
     if combined is None:
         return
 
-    raw_scan = [val for val in wifi_scan_dict if val["connected"] != "unknown"]
-    out_scan = pd.DataFrame.from_dict(raw_scan)
+    out_scan = write_csv.to_frame(wifi_scan_dict, "wifi_scan")
+    out_scan = out_scan[out_scan["connected"] != "unknown"]
+    if (out_scan.shape[0] == 0):
+        return
+    out_scan = out_scan.astype({"connected": bool})
     if ("test_uuid" not in out_scan.columns
             or "interface" not in out_scan.columns
             or "corr_test" not in out_scan.columns):
@@ -216,45 +245,23 @@ def create_csv(tput_dict, wifi_scan_dict):
         out_scan = pd.concat([out_scan_ip,
                               out_scan_st_dl,
                               out_scan_st_ul], ignore_index=True)
-        out_scan["test_uuid_concat"] = out_scan[[
-            "test_uuid", "corr_test"]].apply(lambda x: '-'.join(x), axis=1)
+        out_scan["test_uuid_concat"] = (
+            out_scan["test_uuid"].astype(str) + "-"
+            + out_scan["corr_test"].astype(str))
         out_scan = out_scan.set_index("test_uuid_concat")
         logging.info(out_scan.index)
 
         # Join tput with connected AP
         combined = combined.join(out_scan[out_scan["connected"]].filter(
-            items=["active_wlan", "rssi_dbm", "primary_freq_mhz",
-                   "center_freq_mhz", "min_freq_mhz", "max_freq_mhz", "bw_mhz",
-                   "amendment", "tx_power_dbm", "link_margin_db", "sta_count",
-                   "ch_utilization", "available_admission_capacity_sec",
-                   "link_mean_rssi_dbm", "link_max_rssi_dbm",
-                   "link_min_rssi_dbm", "link_median_rssi_dbm",
-                   "link_mean_tx_bitrate_mbps", "link_max_tx_bitrate_mbps",
-                   "link_min_tx_bitrate_mbps", "link_median_tx_bitrate_mbps",
-                   "link_mean_rx_bitrate_mbps", "link_max_rx_bitrate_mbps",
-                   "link_min_rx_bitrate_mbps", "link_median_rx_bitrate_mbps"]),
-            on="test_uuid_concat")
+            items=conn_ap_cols), on="test_uuid_concat")
         logging.info(combined)
 
         # Get the overlap of connected and neighboring APs
-        out_scan_overlap = out_scan[~out_scan["connected"]].join(
-            out_scan[out_scan["connected"]],
-            on="test_uuid_concat",
-            rsuffix='_conn')
-
+        df_overlap, overlap_full, overlap_primary = get_overlaps(out_scan)
         combined = join_overlap(
-            combined, out_scan_overlap, "overlap_full",
-            lambda x: ((x["min_freq_mhz_conn"]
-                        <= x["max_freq_mhz"])
-                       & (x["min_freq_mhz"]
-                          <= x["max_freq_mhz_conn"])))
-
+            combined, df_overlap[overlap_full], "overlap_full")
         combined = join_overlap(
-            combined, out_scan_overlap, "overlap_primary",
-            lambda x: ((x["primary_min_freq_mhz_conn"]
-                        <= x["primary_max_freq_mhz"])
-                       & (x["primary_min_freq_mhz"]
-                          <= x["primary_max_freq_mhz_conn"])))
+            combined, df_overlap[overlap_primary], "overlap_primary")
 
     combined = combined.sort_values("timestamp")
     logging.info(combined)
@@ -303,6 +310,8 @@ def parse(list_args=None):
                               "be in ISO format, ex: 2024-06-14T17:00-0500)"))
     parser.add_argument("-J", "--json", action="store_true",
                         help="Output as JSON.")
+    parser.add_argument("-P", "--parquet", action="store_true",
+                        help="Output as Parquet.")
     parser.add_argument("-o", "--output-file", nargs='?',
                         type=argparse.FileType('w'), default=sys.stdout,
                         help="Output result to file, default is to stdout'")
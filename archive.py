@@ -0,0 +1,174 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import struct
+import zipfile
+
+
+# Each archive has a manifest next to it listing the [size, mtime_ns] of the
+# source of each entry, so only new or changed files are compressed.
+def get_manifest_file(archive_file):
+    return archive_file.with_name(f".{archive_file.name}.json")
+
+
+def read_manifest(archive_file):
+    manifest_file = get_manifest_file(archive_file)
+    if not archive_file.is_file():
+        return dict()
+    if not manifest_file.is_file():
+        # Archive without a manifest, e.g. made by "zip -ur". The sources of
+        # its members are unknown, so they are updated once, and members of
+        # deleted files are kept.
+        with zipfile.ZipFile(archive_file, "r") as src:
+            return {name: None for name in src.namelist()}
+    with open(manifest_file, "r") as fd:
+        return json.load(fd)
+
+
+def get_stamp(path):
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def list_entries(directory, pattern="*", prefix=""):
+    # Entries of the files and directories under directory matching
+    # pattern, in the form used by update_archive: {arcname: (stamp, path)}.
+    # Directories get a member like in "zip -r", without a stamp as only
+    # their files are updated.
+    entries = dict()
+    for path in sorted(directory.rglob(pattern)):
+        if path.name.startswith("."):
+            continue
+        name = prefix + path.relative_to(directory).as_posix()
+        if path.is_dir():
+            entries[name + "/"] = (None, path)
+        elif path.is_file():
+            entries[name] = (get_stamp(path), path)
+    return entries
+
+
+def list_archive_entries(archive_file, prefix=""):
+    # Entries of the members of an archive built by update_archive, to copy
+    # them to another archive without recompressing
+    return {prefix + name: (stamp, (archive_file, name))
+            for name, stamp in read_manifest(archive_file).items()}
+
+
+def strip_zip64_extra(extra):
+    # Drop the Zip64 fields of a member's extra data, ZipFile writes them
+    # again for the new header offset and sizes if needed
+    out = b""
+    i = 0
+    while (i + 4 <= len(extra)):
+        field_id, size = struct.unpack("<HH", extra[i:i + 4])
+        if (field_id != 1):
+            out += extra[i:i + 4 + size]
+        i += 4 + size
+    return out
+
+
+def copy_entry(src, info, out, name):
+    # Copy the compressed data of a member of src to out as is. zipfile has
+    # no API for this, so it relies on the internals of CPython's ZipFile:
+    # the file objects src.fp and out.fp, out.start_dir (where the next
+    # member goes), and out.filelist, out.NameToInfo and out._didModify
+    # (what close() writes to the central directory). test_archive.py
+    # checks the resulting archives.
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    src.fp.seek(info.header_offset + zipfile.sizeFileHeader
+                + name_len + extra_len)
+
+    new_info = zipfile.ZipInfo(name, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    new_info.external_attr = info.external_attr
+    new_info.create_system = info.create_system
+    new_info.extra = strip_zip64_extra(info.extra)
+    new_info.comment = info.comment
+    # Sizes are known, so they go in the local header instead of a trailing
+    # data descriptor
+    new_info.flag_bits = info.flag_bits & ~0x08
+
+    # zipfile has no API to write compressed data, write it the same way
+    # ZipFile.write does and let close() write the central directory.
+    out.fp.seek(out.start_dir)
+    new_info.header_offset = out.fp.tell()
+    out.fp.write(new_info.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.fp.read(min(remaining, 1 << 20))
+        out.fp.write(chunk)
+        remaining -= len(chunk)
+    out.start_dir = out.fp.tell()
+    out.filelist.append(new_info)
+    out.NameToInfo[name] = new_info
+    out._didModify = True
+
+
+def write_entries(out, entries, names):
+    sources = dict()
+    for name in names:
+        source = entries[name][1]
+        if isinstance(source, tuple):
+            # Member of another archive
+            src_file, src_name = source
+            if src_file not in sources:
+                sources[src_file] = zipfile.ZipFile(src_file, "r")
+            copy_entry(sources[src_file],
+                       sources[src_file].getinfo(src_name), out, name)
+        else:
+            out.write(source, name)
+    for src in sources.values():
+        src.close()
+
+
+def update_archive(archive_file, entries):
+    # Add new entries to archive_file and replace the changed ones, entries
+    # that are not listed anymore are kept like "zip -u" does. Returns the
+    # number of written entries.
+    manifest = read_manifest(archive_file)
+    added = [name for name in entries if name not in manifest]
+    changed = [name for name in entries
+               if name in manifest and manifest[name] != entries[name][0]]
+    if (len(added) == 0 and len(changed) == 0):
+        logging.info("%s is up to date", archive_file)
+        return 0
+
+    logging.info("Updating %s, %d new and %d changed entries",
+                 archive_file, len(added), len(changed))
+    if (len(manifest) > 0 and len(changed) == 0):
+        with zipfile.ZipFile(archive_file, "a",
+                             compression=zipfile.ZIP_DEFLATED) as out:
+            write_entries(out, entries, added)
+    else:
+        # Members cannot be replaced in place, rebuild the archive by
+        # copying the unchanged members as is.
+        tmp_file = archive_file.with_name(f".{archive_file.name}.tmp")
+        with zipfile.ZipFile(tmp_file, "w",
+                             compression=zipfile.ZIP_DEFLATED) as out:
+            if (len(manifest) > 0):
+                with zipfile.ZipFile(archive_file, "r") as src:
+                    for info in src.infolist():
+                        if info.filename not in changed:
+                            copy_entry(src, info, out, info.filename)
+            write_entries(out, entries, changed + added)
+        os.replace(tmp_file, archive_file)
+
+    for name in added + changed:
+        manifest[name] = entries[name][0]
+    with open(get_manifest_file(archive_file), "w") as fd:
+        fd.write(json.dumps(manifest))
+    return len(added) + len(changed)
+
+
+def update_archives(jobs, num_threads=4):
+    # Update several archives concurrently, jobs is a list of
+    # (archive_file, entries). Compression runs without the GIL, so threads
+    # are enough to use several cores.
+    with ThreadPoolExecutor(num_threads) as executor:
+        return list(executor.map(lambda job: update_archive(*job), jobs))
@@ -1,30 +1,126 @@
 import aggregate_tput_tests as agg_tput
 import tput_data_stats
+import archive
 import argparse
 from datetime import datetime
+import filecmp
+from functools import partial
 import json
 import logging
-from multiprocessing import Pool
+import os
 from pathlib import Path
-import subprocess
 import firebase_admin
 from firebase_admin import credentials
 import firebase_download
 import firebase_list_devices
+import scheduler
+import stage_stats
 import write_csv
 
 
 args = None
 rpi_timings = dict()
 heartbeats = None
+fingerprints = dict()
+summaries = dict()
+# Files in outdir kept for the next runs, not part of the data
+bookkeeping_files = ["batch_report.json", "fingerprints.json"]
 
 
-def process_mac(mac):
-    global rpi_timings
-    agg_tput_df = None
+def get_fingerprint(mac, newest_mtime_ns=None):
+    # Fingerprint of the logs of mac and the options affecting its outputs.
+    # If newest_mtime_ns is set, only files not newer than it are counted.
+    num_files = 0
+    newest = 0
+    total_bytes = 0
+    last_file = None
+    for path in args.log_dir.joinpath(mac).rglob("*"):
+        if not path.is_file():
+            continue
+        stat = path.stat()
+        if (newest_mtime_ns is not None
+                and stat.st_mtime_ns > newest_mtime_ns):
+            continue
+        num_files += 1
+        newest = max(newest, stat.st_mtime_ns)
+        total_bytes += stat.st_size
+        if (last_file is None or write_csv.get_file_order(path)
+                > write_csv.get_file_order(last_file)):
+            last_file = path
+    return {
+        "num_files": num_files,
+        "newest_mtime_ns": newest,
+        "total_bytes": total_bytes,
+        "last_file": (None if last_file is None
+                      else last_file.relative_to(args.log_dir).as_posix()),
+        "start": rpi_timings[mac]["start"] if mac in rpi_timings else None,
+        "end": rpi_timings[mac]["end"] if mac in rpi_timings else None,
+        "parquet": args.parquet
+    }
 
-    # 3.1. Write tput
-    print(f"Writing throughput CSV and JSON for {mac}...")
+
+def is_append_only(mac):
+    # True if the logs of mac only got new files since the last run, i.e.
+    # the files up to the last newest mtime are the same as before, and the
+    # new files are read after them. Only then are the appended lines where
+    # a full run puts them.
+    if args.full or mac not in fingerprints:
+        return False
+    last = fingerprints[mac]
+    if get_fingerprint(mac, last["newest_mtime_ns"]) != last:
+        return False
+    if last["last_file"] is None:
+        return True
+    last_file = write_csv.get_file_order(
+        args.log_dir.joinpath(last["last_file"]))
+    return all(write_csv.get_file_order(path) > last_file
+               for path in args.log_dir.joinpath(mac).rglob("*")
+               if path.is_file()
+               and path.stat().st_mtime_ns > last["newest_mtime_ns"])
+
+
+def get_output_files(table, mac=None):
+    formats = ["json", "csv"] + (["parquet"] if args.parquet else [])
+    name = table if mac is None else f"{table}_{mac}"
+    return {fmt: args.outdir.joinpath(f"{name}.{fmt}") for fmt in formats}
+
+
+def write_if_changed(write_files, outputs):
+    # Write the {fmt: path} outputs with write_files(outputs) through
+    # temporary files, and only replace the files whose content changed.
+    # Unchanged files keep their mtime, so they are not archived again.
+    tmp_outputs = {fmt: path.with_name(f".{path.name}.tmp")
+                   for fmt, path in outputs.items()}
+    write_files(tmp_outputs)
+    for fmt, path in outputs.items():
+        if (path.is_file()
+                and filecmp.cmp(tmp_outputs[fmt], path, shallow=False)):
+            tmp_outputs[fmt].unlink()
+        else:
+            os.replace(tmp_outputs[fmt], path)
+
+
+def write_lines(lines, new_lines, mode, mac):
+    # Write all lines of mode, or append new_lines to the existing files
+    output_files = get_output_files(mode, mac)
+    if (new_lines is not None
+            and all(path.is_file() for path in output_files.values())):
+        for path in output_files.values():
+            write_csv.append(new_lines, mode, path)
+        stage_stats.count("rows_emitted", len(new_lines))
+        return
+
+    write_csv.write_files(lines, mode, output_files)
+    stage_stats.count("rows_emitted", len(lines))
+
+
+def get_cache_file():
+    return args.outdir.joinpath(".parse_cache.sqlite")
+
+
+def get_read_params(mac, refresh=False):
+    # write_csv parameters to read the logs of mac, if refresh is set the
+    # cached lines are parsed again
     params = ["throughput",
               "-d", str(args.log_dir),
               "-m", mac,
@@ -33,151 +129,328 @@ def process_mac(mac):
         params += ["--start-time", rpi_timings[mac]["start"]]
     if mac in rpi_timings and rpi_timings[mac]["end"]:
         params += ["--end-time", rpi_timings[mac]["end"]]
-    out_tput = write_csv.read_logs(write_csv.parse(params))
+    if not args.no_parse_cache:
+        params += ["--cache-file", str(get_cache_file())]
+        if refresh:
+            params += ["--refresh-cache"]
+    return params
+
+
+def process_logs(mac, append_only):
+    summary = None
+
+    # 3.1. Read tput, lat, and wifi_scan in a single pass over the logs
+    print(f"Reading throughput, latency, and wifi scan logs for {mac}...")
+    # With --parallel-files, the parse stages already refreshed the cache
+    params = get_read_params(mac, args.full and not args.parallel_files)
+    modes = ["throughput", "latency", "wifi_scan"]
+    out_logs = None
+    new_logs = {mode: None for mode in modes}
+    if append_only:
+        # Only read files added since the last run, their lines are appended
+        # to the outputs. All lines are still needed to recompute the
+        # aggregate tests or to write a table that has no output yet.
+        print(f"Appending logs added since the last run for {mac}...")
+        new_logs = write_csv.read_logs_multi(
+            write_csv.parse(params + [
+                "--newer-than-ns",
+                str(fingerprints[mac]["newest_mtime_ns"])]),
+            modes, columnar=True)
+        if (len(new_logs["throughput"]) == 0
+                and len(new_logs["wifi_scan"]) == 0
+                and all(len(new_logs[mode]) == 0
+                        or all(path.is_file() for path in get_output_files(
+                            mode, mac).values())
+                        for mode in modes)):
+            out_logs = new_logs
+    if out_logs is None:
+        out_logs = write_csv.read_logs_multi(
+            write_csv.parse(params), modes, columnar=True)
+    out_tput = out_logs["throughput"]
+    out_lat = out_logs["latency"]
+    out_scan = out_logs["wifi_scan"]
+
+    # 3.2. Write tput
+    print(f"Writing throughput CSV and JSON for {mac}...")
     if (len(out_tput) > 0):
-        write_csv.write(out_tput, write_csv.parse(
-            ["throughput", "-J",
-             "-o", str(args.outdir.joinpath(
-                       "throughput_{}.json".format(mac))),
-             "-l", args.log_level]))
-        write_csv.write(out_tput, write_csv.parse(
-            ["throughput",
-             "-o", str(args.outdir.joinpath(
-                       "throughput_{}.csv".format(mac))),
-             "-l", args.log_level]))
+        write_lines(out_tput, new_logs["throughput"], "throughput", mac)
     else:
         logging.warning(f"No throughput logs for {mac}! Skipping...")
 
-    # 3.2. Write lat
+    # 3.3. Write lat
     print(f"Writing latency CSV and JSON for {mac}...")
-    params = ["latency",
-              "-d", str(args.log_dir),
-              "-m", mac,
-              "-l", args.log_level]
-    if mac in rpi_timings and rpi_timings[mac]["start"]:
-        params += ["--start-time", rpi_timings[mac]["start"]]
-    if mac in rpi_timings and rpi_timings[mac]["end"]:
-        params += ["--end-time", rpi_timings[mac]["end"]]
-    out_lat = write_csv.read_logs(write_csv.parse(params))
     if (len(out_lat) > 0):
-        write_csv.write(out_lat, write_csv.parse(
-            ["latency", "-J",
-             "-o", str(args.outdir.joinpath(
-                       "latency_{}.json".format(mac))),
-             "-l", args.log_level]))
-        write_csv.write(out_lat, write_csv.parse(
-            ["latency",
-             "-o", str(args.outdir.joinpath(
-                       "latency_{}.csv".format(mac))),
-             "-l", args.log_level]))
+        write_lines(out_lat, new_logs["latency"], "latency", mac)
     else:
         logging.warning(f"No latency logs for {mac}! Skipping...")
 
-    # 3.3. Write wifi_scan
+    # 3.4. Write wifi_scan
     print(f"Writing wifi scan CSV and JSON for {mac}...")
-    params = ["wifi_scan",
-              "-d", str(args.log_dir),
-              "-m", mac,
-              "-l", args.log_level]
-    if mac in rpi_timings and rpi_timings[mac]["start"]:
-        params += ["--start-time", rpi_timings[mac]["start"]]
-    if mac in rpi_timings and rpi_timings[mac]["end"]:
-        params += ["--end-time", rpi_timings[mac]["end"]]
-    out_scan = write_csv.read_logs(write_csv.parse(params))
     if (len(out_scan) > 0):
-        write_csv.write(out_scan, write_csv.parse(
-            ["wifi_scan", "-J",
-             "-o", str(args.outdir.joinpath(
-                       "wifi_scan_{}.json".format(mac))),
-             "-l", args.log_level]))
-        write_csv.write(out_scan, write_csv.parse(
-            ["wifi_scan",
-             "-o", str(args.outdir.joinpath(
-                       "wifi_scan_{}.csv".format(mac))),
-             "-l", args.log_level]))
+        write_lines(out_scan, new_logs["wifi_scan"], "wifi_scan", mac)
     else:
         logging.warning(f"No Wi-Fi scan logs for {mac}! Skipping...")
 
-    # 3.4 Write aggregate throughput tests
+    # 3.5. Write aggregate throughput tests
     print(f"Writing aggregate tput CSV and JSON for {mac}...")
-    if len(out_tput) > 0:
+    if out_logs is new_logs:
+        # No new tests, reuse the previous summary
+        summary = summaries.get(mac)
+    elif len(out_tput) > 0:
         agg_tput_df = agg_tput.create_csv(out_tput, out_scan)
         if (agg_tput_df is not None):
-            agg_tput.write(agg_tput_df, agg_tput.parse(
-                [mac,
-                 "-J", "-o", str(args.outdir.joinpath(
-                                 f"agg_tput_{mac}.json")),
-                 "-l", args.log_level]))
-            agg_tput.write(agg_tput_df, agg_tput.parse(
-                [mac,
-                 "-o", str(args.outdir.joinpath(f"agg_tput_{mac}.csv")),
-                 "-l", args.log_level]))
+            stage_stats.count("rows_emitted", len(agg_tput_df))
+            agg_tput.write_files(agg_tput_df,
+                                 get_output_files("agg_tput", mac))
+            # Only the summary is sent back for the device list, the table
+            # stays in this process
+            summary = tput_data_stats.get_device_summary(agg_tput_df)
         else:
             logging.warning(f"No aggregate tput for {mac}! Skipping...")
     else:
         logging.warning(f"No throughput logs for {mac}! Skipping...")
 
-    # 3.5. Write heartbeats
+    has_logs = (len(out_tput) > 0
+                or len(out_lat) > 0
+                or len(out_scan) > 0)
+    return summary, has_logs
+
+
+def fetch_device_states():
+    print("1. Download device states")
+    heartbeats = firebase_list_devices.fetch_all()
+    device_list = firebase_list_devices.get_list(heartbeats,
+                                                 args.log_dir)
+    return heartbeats, device_list
+
+
+def download_logs(last_update):
+    print("2. Download all logs")
+    if args.skip_dl:
+        print("Skipping downloading Firebase files...")
+        return
+    download_args = []
+    if last_update:
+        download_args += ["--start-date", last_update]
+    if args.rsync:
+        download_args += ["--rsync"]
+    firebase_download.download(firebase_download.parse(download_args))
+
+
+def has_changed(mac, fingerprint):
+    return args.full or fingerprints.get(mac) != fingerprint
+
+
+def list_log_files(mac):
+    # 3.0. With --parallel-files, list the files of mac to parse once and
+    # split them into one stripe per worker, None if mac is unchanged
+    if not has_changed(mac, get_fingerprint(mac)):
+        return None
+    file_tasks = write_csv.get_file_tasks(
+        write_csv.parse(get_read_params(mac)),
+        ["throughput", "latency", "wifi_scan"])
+    print(f"Parsing {len(file_tasks)} files of {mac} in "
+          f"{args.num_parallel} stripes...")
+    return [file_tasks[i::args.num_parallel]
+            for i in range(args.num_parallel)]
+
+
+def parse_logs(mac, stripe, file_stripes):
+    # 3.0. Parse a stripe of the files of mac into the parse cache. The
+    # stripes of all MACs share the worker processes, the logs task of mac
+    # then reads its lines from the cache.
+    if file_stripes is None:
+        return
+    write_csv.cache_logs(write_csv.parse(get_read_params(mac, args.full)),
+                         file_stripes[stripe])
+
+
+def write_logs(mac):
+    # 3.1. - 3.5. Read the logs of mac and write its tables, the logs are
+    # only read if they changed since the last run
+    summary = None
+    has_logs = False
+    fingerprint = get_fingerprint(mac)
+    is_changed = has_changed(mac, fingerprint)
+    if is_changed:
+        summary, has_logs = process_logs(mac, is_append_only(mac))
+    else:
+        print(f"Logs of {mac} are unchanged since the last run, skipping...")
+        summary = summaries.get(mac)
+
+    return {
+        "mac": mac,
+        "summary": summary,
+        "has_logs": has_logs,
+        "is_changed": is_changed,
+        "fingerprint": fingerprint
+    }
+
+
+def write_heartbeats(mac):
+    # 3.6. Write heartbeats, returns True if mac has any
     out_hbeat = firebase_list_devices.get_mac(heartbeats, mac)
     print(f"Writing heartbeat CSV and JSON for {mac}...")
     if (len(out_hbeat) > 0):
-        firebase_list_devices.write(
-            out_hbeat,
-            firebase_list_devices.parse(
-                ["-J", "-m", mac, "-o", str(args.outdir.joinpath(
-                    "heartbeat_{}.json".format(mac))),
-                 "-l", args.log_level]))
-        firebase_list_devices.write(
-            out_hbeat,
-            firebase_list_devices.parse(
-                ["-m", mac, "-o", str(args.outdir.joinpath(
-                    "heartbeat_{}.csv".format(mac))),
-                 "-l", args.log_level]))
+        # Heartbeats are fetched again every run, but mostly unchanged
+        write_if_changed(
+            partial(firebase_list_devices.write_files, out_hbeat, mac=mac),
+            get_output_files("heartbeat", mac))
     else:
         logging.warning(f"No HB logs for {mac}! Skipping...")
+    stage_stats.count("rows_emitted", len(out_hbeat))
+    return len(out_hbeat) > 0
 
-    # 3.6. Zip CSVs & JSONs
-    print(f"Compressing CSV and JSON files for {mac}...")
-    if (len(out_tput) > 0
-            or len(out_lat) > 0
-            or len(out_scan) > 0
-            or len(out_hbeat) > 0):
-        cmd_out = subprocess.run(
-            ["zip", "-ur",
-             str(args.outdir.joinpath(
-                 "data_{}.zip".format(mac)).resolve()),
-             ".", "-i",
-             "*_{}.json".format(mac),
-             "*_{}.csv".format(mac)],
-            cwd=str(args.outdir.resolve()),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT).stdout.decode("utf-8")
-        logging.info(cmd_out)
-    else:
+
+def archive_mac(mac, logs, has_hbeat):
+    # 3.7. Zip CSVs & JSONs, and raw logs
+    print(f"Compressing CSV and JSON files, and raw logs for {mac}...")
+    archive_jobs = list()
+    if (logs["has_logs"] or has_hbeat):
+        data_entries = dict()
+        for ext in ["json", "csv", "parquet"]:
+            data_entries.update(archive.list_entries(
+                args.outdir, f"*_{mac}.{ext}"))
+        archive_jobs.append((args.outdir.joinpath(f"data_{mac}.zip"),
+                             data_entries))
+    elif logs["is_changed"]:
         logging.warning(f"No CSV or JSON files for {mac}! Skipping...")
+    # Otherwise the tables of mac are unchanged and so is its data archive
+    if (logs["is_changed"] and args.log_dir.joinpath(mac).is_dir()):
+        archive_jobs.append((args.outdir.joinpath(f"rawlogs_{mac}.zip"),
+                             archive.list_entries(args.log_dir.joinpath(mac))))
+    stage_stats.count("files_archived",
+                      sum(archive.update_archives(archive_jobs)))
 
-    # 3.7. Zip raw logs
-    print(f"Compressing raw logs for {mac}...")
-    if (args.log_dir.joinpath(mac).is_dir()):
-        cmd_out = subprocess.run(
-            ["zip", "-ur",
-             str(args.outdir.joinpath(
-                 "rawlogs_{}.zip".format(mac)).resolve()),
-             "."],
-            cwd=str(args.log_dir.joinpath(mac).resolve()),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT).stdout.decode("utf-8")
-        logging.info(cmd_out)
 
-    return {
-        "mac": mac,
-        "agg_tput_df": agg_tput_df
-    }
+def write_device_list(device_list, *all_logs):
+    print("4. Combine device states with data stats and write it")
+    for x in all_logs:
+        fingerprints[x["mac"]] = x["fingerprint"]
+        if x["summary"] is not None:
+            summaries[x["mac"]] = x["summary"]
+        else:
+            summaries.pop(x["mac"], None)
+    device_list = tput_data_stats.combine_device_summaries(
+        device_list, summaries, remove_empty=True)
+    stage_stats.count("rows_emitted", len(device_list))
+    # The JSON is a list of records, one per MAC
+    write_if_changed(
+        partial(tput_data_stats.write_files, device_list,
+                table="device_list", as_records=True),
+        get_output_files("device_list"))
+
+
+def archive_all(macs):
+    print("5. Compress all CSVs & JSONs, and all logs")
+    # Members of the per-MAC archives are copied without recompressing
+    all_data_entries = dict()
+    for ext in ["json", "csv", "parquet"]:
+        all_data_entries.update(archive.list_entries(
+            args.outdir, f"*.{ext}"))
+    for name in bookkeeping_files:
+        all_data_entries.pop(name, None)
+    all_rawlogs_entries = dict()
+    for mac in macs:
+        all_data_entries.update(archive.list_archive_entries(
+            args.outdir.joinpath(f"data_{mac}.zip")))
+        if args.log_dir.joinpath(mac).is_dir():
+            all_rawlogs_entries[f"{mac}/"] = (None, args.log_dir.joinpath(mac))
+        all_rawlogs_entries.update(archive.list_archive_entries(
+            args.outdir.joinpath(f"rawlogs_{mac}.zip"), prefix=f"{mac}/"))
+    stage_stats.count("files_archived", sum(archive.update_archives([
+        (args.outdir.joinpath("all_data.zip"), all_data_entries),
+        (args.outdir.joinpath("all_rawlogs.zip"), all_rawlogs_entries)])))
+
+
+def write_last_update():
+    print("6. Write last update JSON")
+    with open(args.outdir.joinpath("last_update.json"), "w") as fd:
+        fd.write(json.dumps({
+            "last_update": datetime.now().astimezone().isoformat(
+                timespec="seconds")}))
+    with open(args.outdir.joinpath("fingerprints.json"), "w") as fd:
+        fd.write(json.dumps(fingerprints))
+    with open(args.outdir.joinpath(".device_summaries.json"), "w") as fd:
+        # Summary values are NumPy scalars
+        fd.write(json.dumps(summaries, default=lambda x: x.item()))
+
+
+def write_report(task_stats, start_time):
+    # Write the stats of each (mac, stage) task, and their totals per stage.
+    # Peaks are the maximum over the MACs, the other values are summed.
+    stages = dict()
+    tasks = list()
+    for name, stats in sorted(task_stats.items()):
+        # Parse tasks are named (mac, "parse", "list" or stripe)
+        mac, stage = name[:2]
+        tasks.append({"mac": mac, "stage": stage, **stats})
+        totals = stages.setdefault(stage, {"num_tasks": 0})
+        totals["num_tasks"] += 1
+        for key, value in stats.items():
+            if key.startswith("peak_"):
+                totals[key] = max(totals.get(key, 0), value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+    end_time = datetime.now().astimezone()
+    with open(args.outdir.joinpath("batch_report.json"), "w") as fd:
+        fd.write(json.dumps({
+            "start_time": start_time.isoformat(timespec="seconds"),
+            "end_time": end_time.isoformat(timespec="seconds"),
+            "wall_time_s": (end_time - start_time).total_seconds(),
+            "num_parallel": args.num_parallel,
+            "stages": stages,
+            "tasks": tasks}, indent=2))
+
+
+def get_tasks(macs, device_list, last_update):
+    # Stages of each MAC as (mac, stage) tasks. The logs of a MAC are read,
+    # written and aggregated in one task as they share the parsed lines.
+    # Larger MACs go first so they do not end up running alone at the end.
+    sizes = {mac: get_fingerprint(mac)["total_bytes"] for mac in macs}
+    macs = sorted(macs, key=lambda mac: (-sizes[mac], mac))
+    tasks = [scheduler.Task(("all", "download"), download_logs,
+                            args=[last_update], priority=float("inf"),
+                            local=True)]
+    for mac in macs:
+        after = [("all", "download")]
+        if args.parallel_files:
+            # Parse the files of mac in stripes, the stripes of the larger
+            # MACs go first and spread over all workers. The files are
+            # listed once for all stripes.
+            listing = (mac, "parse", "list")
+            stripes = [(mac, "parse", str(i))
+                       for i in range(args.num_parallel)]
+            tasks.append(scheduler.Task(listing, list_log_files, args=[mac],
+                                        after=after, priority=sizes[mac]))
+            tasks += [scheduler.Task(name, parse_logs, args=[mac, i],
+                                     deps=[listing], priority=sizes[mac])
+                      for i, name in enumerate(stripes)]
+            after = stripes
+        tasks += [
+            scheduler.Task((mac, "logs"), write_logs, args=[mac],
+                           after=after, priority=sizes[mac]),
+            scheduler.Task((mac, "heartbeat"), write_heartbeats, args=[mac],
+                           priority=sizes[mac]),
+            scheduler.Task((mac, "archive"), archive_mac, args=[mac],
+                           deps=[(mac, "logs"), (mac, "heartbeat")],
+                           priority=sizes[mac])]
+    tasks += [
+        scheduler.Task(("all", "device_list"), write_device_list,
+                       args=[device_list],
+                       deps=[(mac, "logs") for mac in macs], local=True),
+        scheduler.Task(("all", "archive"), archive_all, args=[macs],
+                       after=([("all", "device_list")]
+                              + [(mac, "archive") for mac in macs]),
+                       local=True),
+        scheduler.Task(("all", "last_update"), write_last_update,
+                       after=[("all", "archive")], local=True)]
+    return tasks
 
 
 def batch_extract():
     # Setup
-    global rpi_timings, heartbeats
+    global rpi_timings, heartbeats, fingerprints, summaries
     logging.basicConfig(level=args.log_level.upper())
     if args.rpi_timings.is_file():
         with open(args.rpi_timings) as file:
@@ -190,81 +463,54 @@ def batch_extract():
             last_update = json.load(fd)["last_update"]
             print(f"Got last update: {last_update}")
 
-    print("1. Download device states")
-    heartbeats = firebase_list_devices.fetch_all()
-    device_list = firebase_list_devices.get_list(heartbeats,
-                                                 args.log_dir)
+    # Fingerprints of each MAC's logs at the last update, unchanged MACs are
+    # skipped and MACs with only new files get their new lines appended.
+    fingerprints_file = args.outdir.joinpath("fingerprints.json")
+    if fingerprints_file.is_file() and not args.full:
+        with open(fingerprints_file, "r") as fd:
+            fingerprints = json.load(fd)
+    # Device list stats of each MAC, reused for the unchanged MACs
+    summaries_file = args.outdir.joinpath(".device_summaries.json")
+    if summaries_file.is_file() and not args.full:
+        with open(summaries_file, "r") as fd:
+            summaries = json.load(fd)
+
+    # The lines cached by an earlier run would be outdated by the next run
+    # using the cache
+    if args.no_parse_cache and get_cache_file().is_file():
+        print("Removing the parse cache...")
+        for suffix in ["", "-wal", "-shm"]:
+            get_cache_file().with_name(
+                get_cache_file().name + suffix).unlink(missing_ok=True)
+
+    profile_dir = None
+    if args.profile:
+        profile_dir = args.outdir.joinpath("profile")
+        profile_dir.mkdir(exist_ok=True)
+
+    start_time = datetime.now().astimezone()
+    (heartbeats, device_list), states_stats = stage_stats.measure(
+        fetch_device_states, [], local=True,
+        profile_prefix=scheduler.get_profile_prefix(
+            profile_dir, ("all", "device_states")))
     macs = [entry["mac"] for entry in device_list
             if entry["mac"].startswith("RPI-")]
     logging.info(macs)
     # Write device states later after it got throughput stats
 
-
-    print("2. Download and zip all logs")
-    if args.skip_dl:
-        print("Skipping downloading Firebase files...")
-    else:
-        download_args = []
-        if last_update:
-            download_args += ["--start-date", last_update]
-        if args.rsync:
-            download_args += ["--rsync"]
-        firebase_download.download(firebase_download.parse(download_args))
-    print("Zipping all logs...")
-    cmd_out = subprocess.run(
-        ["zip", "-ur",
-         str(args.outdir.joinpath("all_rawlogs.zip").resolve())] + macs,
-        cwd=str(args.log_dir.resolve()),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT).stdout.decode("utf-8")
-    logging.info(cmd_out)
-
-    print("3. Write CSV and JSON for each MAC")
-    agg_tput_data = list()
+    # 2. - 6. Run the stages of all MACs, each stage starts as soon as the
+    # stages it depends on are done
     if args.num_parallel > 1:
         print(f"Running {args.num_parallel} parallel processes, log texts "
-              "may be unordered.")
-        with Pool(args.num_parallel) as p:
-            agg_tput_data = p.map(process_mac, macs)
-    else:
-        for mac in macs:
-            agg_tput_data += [process_mac(mac)]
-
-    print("4. Combine device states with data stats and write it")
-    agg_tput_data = {x["mac"]: x["agg_tput_df"] for x in agg_tput_data
-                     if x["agg_tput_df"] is not None}
-    device_list = tput_data_stats.combine_device_list(
-        device_list, agg_tput_data, remove_empty=True)
-    # 4.1 Write as JSON
-    tput_data_stats.write(
-        device_list,
-        tput_data_stats.parse(
-            ["all", "-J", "-o", str(args.outdir.joinpath("device_list.json")),
-             "-l", args.log_level]),
-        as_records=True)
-    # 4.2 Write as CSV
-    tput_data_stats.write(
-        device_list,
-        tput_data_stats.parse(
-            ["all", "-o", str(args.outdir.joinpath("device_list.csv")),
-             "-l", args.log_level]))
-
-    print("5. Compress all CSVs & JSONs")
-    cmd_out = subprocess.run(
-        ["zip", "-ur",
-         str(args.outdir.joinpath("all_data.zip").resolve()),
-         ".", "-i", "*.json", "*.csv"],
-        cwd=str(args.outdir.resolve()),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT).stdout.decode("utf-8")
-    logging.info(cmd_out)
-
-    print("6. Write last update JSON")
-    with open(args.outdir.joinpath("last_update.json"), "w") as fd:
-        fd.write(json.dumps({
-            "last_update": datetime.now().astimezone().isoformat(
-                timespec="seconds")}))
+              "are printed per MAC and stage as they finish.")
+    if args.parallel_files:
+        print(f"Parsing the files of each MAC in {args.num_parallel} "
+              "stripes.")
+    _, task_stats = scheduler.run(get_tasks(macs, device_list, last_update),
+                                  args.num_parallel, profile_dir)
 
+    task_stats[("all", "device_states")] = states_stats
+    write_report(task_stats, start_time)
     print("Done!")
 
 
@@ -276,10 +522,28 @@ def parse(list_args=None):
                         help="Specify local log directory, default='./logs'")
     parser.add_argument("-p", "--num-parallel", type=int, default=8,
                         help="Specify number of parallel processes, default=8")
+    parser.add_argument("--parallel-files", action="store_true",
+                        help=("Also parallelize parsing across the files of "
+                              "each MAC, needs the parse cache"))
     parser.add_argument("--rsync", action="store_true",
                         help="Use rsync to server instead of Firebase")
     parser.add_argument("--skip-dl", action="store_true",
                         help="Skip downloading new files from Firebase")
+    parser.add_argument("--no-parse-cache", action="store_true",
+                        help=("Parse all logs instead of reusing parsed "
+                              "lines cached in the output directory, and "
+                              "remove the cache"))
+    parser.add_argument("--full", action="store_true",
+                        help=("Regenerate the outputs of every MAC instead of "
+                              "only the MACs with new logs, and parse their "
+                              "logs again"))
+    parser.add_argument("--parquet", action="store_true",
+                        help=("Also write Parquet files with declared column "
+                              "types next to the CSVs and JSONs"))
+    parser.add_argument("--profile", action="store_true",
+                        help=("Write cProfile and tracemalloc dumps of each "
+                              "stage to the profile directory in outdir, "
+                              "this slows down the run"))
     parser.add_argument("--rpi-timings", type=Path,
                         default=Path("./.rpi-timings.json"),
                         help=("Specify RPI timings file, "
@@ -287,9 +551,12 @@ def parse(list_args=None):
     parser.add_argument("-l", "--log-level", default="warning",
                         help="Provide logging level, default is warning'")
     if (list_args is None):
-        return parser.parse_args()
+        args = parser.parse_args()
     else:
-        return parser.parse_args(args=list_args)
+        args = parser.parse_args(args=list_args)
+    if (args.parallel_files and args.no_parse_cache):
+        parser.error("--parallel-files needs the parse cache")
+    return args
 
 
 if __name__ == '__main__':
@@ -1,5 +1,6 @@
 import argparse
 from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
 from crc32c import crc32c
 from datetime import datetime, timedelta, timezone
 import firebase_admin
@@ -20,6 +21,62 @@ def compare_file_crc32c(path, comp_crc32c):
         return file_crc == to_compare
 
 
+def list_files(bucket, prefix=None, match_glob=None):
+    iter_blobs = bucket.list_blobs(
+        fields="items(name,crc32c),nextPageToken",
+        prefix=prefix, match_glob=match_glob)
+    return [{
+        "name": file.name,
+        "crc32c": file.crc32c
+    } for file in iter_blobs]
+
+
+def list_prefixes(bucket, prefix=None):
+    # List the "directories" right under prefix, i.e. "<mac>/" or
+    # "<mac>/<log-type>/"
+    iter_blobs = bucket.list_blobs(
+        fields="prefixes,nextPageToken",
+        prefix=prefix, delimiter="/")
+    # prefixes is filled while going through the pages
+    for page in iter_blobs.pages:
+        pass
+    return sorted(iter_blobs.prefixes)
+
+
+def list_dates(bucket, dates, num_threads=16, days_per_glob=31):
+    # List the files of the given dates under every <mac>/<log-type>/
+    # prefix of the bucket, concurrently. Each listing only goes through a
+    # single prefix and matches several dates at once, instead of matching
+    # */*/{date}* against the whole bucket for each date.
+    with ThreadPoolExecutor(num_threads) as executor:
+        macs = list_prefixes(bucket)
+        logging.info("Found %d devices", len(macs))
+        prefixes = [prefix
+                    for mac_prefixes in executor.map(
+                        lambda mac: list_prefixes(bucket, mac), macs)
+                    for prefix in mac_prefixes]
+        logging.info("Found %d device prefixes", len(prefixes))
+
+        jobs = list()
+        for i in range(0, len(dates), days_per_glob):
+            glob_dates = dates[i:i + days_per_glob]
+            dates_str = ",".join(glob_dates)
+            if (len(glob_dates) > 1):
+                dates_str = f"{{{dates_str}}}"
+            jobs += [(prefix, f"{prefix}{dates_str}*")
+                     for prefix in prefixes]
+        # Log files are right under <mac>/
+        jobs.append((None, "*/*.log.*"))
+        listings = executor.map(lambda job: list_files(bucket, *job), jobs)
+
+        # Merge the listings, a file may be matched by several of them
+        all_files = dict()
+        for listing in listings:
+            for file in listing:
+                all_files[file["name"]] = file
+        return [all_files[name] for name in sorted(all_files)]
+
+
 def download_firebase(args):
     # Setup
     logging.basicConfig(level=args.log_level.upper())
@@ -49,35 +106,16 @@ def download_firebase(args):
                     or end_time.tzinfo.utcoffset(end_time) is None):
                 end_time = end_time.astimezone()
 
+        dates = list()
         while start_time < end_time:
-            glob_str = f"*/*/{start_time.date().isoformat()}*"
-            logging.info(f"glob_str={glob_str}")
+            dates.append(start_time.date().isoformat())
             start_time += timedelta(days=1)
-            iter_blobs = bucket.list_blobs(
-                fields="items(name,crc32c),nextPageToken",
-                match_glob=glob_str)
-            all_files += [{
-                "name": file.name,
-                "crc32c": file.crc32c
-            } for file in iter_blobs]
-
-        # List log files
-        iter_blobs = bucket.list_blobs(
-            fields="items(name,crc32c),nextPageToken",
-            match_glob="*/*.log.*")
-        all_files += [{
-            "name": file.name,
-            "crc32c": file.crc32c
-        } for file in iter_blobs]
+        logging.info(f"dates={dates}")
+        all_files += list_dates(bucket, dates, args.list_threads)
 
     else:
         # List all files, takes longer
-        iter_blobs = bucket.list_blobs(
-            fields="items(name,crc32c),nextPageToken")
-        all_files += [{
-            "name": file.name,
-            "crc32c": file.crc32c
-        } for file in iter_blobs]
+        all_files += list_files(bucket)
     logging.info(f"Total # of files: {len(all_files)}")
 
     to_download = list(filter(
@@ -153,6 +191,9 @@ def parse(list_args=None):
                         help=("Specify the end date from which the files "
                               "will be downloaded. Use ISO format, ex: "
                               "2024-05-22"))
+    parser.add_argument("--list-threads", type=int, default=16,
+                        help=("Number of concurrent listings of the bucket, "
+                              "default=16"))
     parser.add_argument("-l", "--log-level", default="warning",
                         help="Provide logging level, default is warning'")
     if (list_args is None):
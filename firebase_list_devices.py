@@ -1,32 +1,57 @@
 import argparse
 import csv
 from datetime import datetime, timezone
+from functools import partial
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import db
 import json
+import json_helper
 import logging
+import pandas as pd
 from pathlib import Path
 import sys
+import table_schema
+
+
+def write_file(outarr, fmt, output_file, mac="disabled",
+               include_legacy_mac=False):
+    fieldnames = ["mac", "online",
+                  "start_timestamp", "last_timestamp"]
+    if (include_legacy_mac):
+        fieldnames.insert(1, 'rpi_id')
+    if (mac == "disabled"):
+        fieldnames += ["last_test_eth", "last_test_wlan",
+                       "data_used_gbytes", "data_cap_gbytes"]
+
+    match fmt:
+        case "json":
+            output_file.write(json.dumps(outarr))
+        case "parquet":
+            df = pd.DataFrame(outarr, columns=fieldnames)
+            table_schema.write_parquet(
+                [df], "device_list" if mac == "disabled" else "heartbeat",
+                output_file)
+        case _:
+            csv_writer = csv.DictWriter(
+                output_file,
+                fieldnames=fieldnames,
+                extrasaction='ignore')
+            csv_writer.writeheader()
+            csv_writer.writerows(outarr)
+
+
+def write_files(outarr, outputs, mac="disabled", include_legacy_mac=False):
+    # Write outarr to each {fmt: path} of outputs concurrently
+    table_schema.write_outputs(
+        partial(write_file, outarr, mac=mac,
+                include_legacy_mac=include_legacy_mac),
+        outputs)
 
 
 def write(outarr, args):
-    if (args.json):
-        args.output_file.write(json.dumps(outarr))
-    else:
-        fieldnames = ["mac", "online",
-                      "start_timestamp", "last_timestamp"]
-        if (args.include_legacy_mac):
-            fieldnames.insert(1, 'rpi_id')
-        if (args.mac == "disabled"):
-            fieldnames += ["last_test_eth", "last_test_wlan",
-                           "data_used_gbytes", "data_cap_gbytes"]
-        csv_writer = csv.DictWriter(
-            args.output_file,
-            fieldnames=fieldnames,
-            extrasaction='ignore')
-        csv_writer.writeheader()
-        csv_writer.writerows(outarr)
+    write_file(outarr, table_schema.get_format(args), args.output_file,
+               args.mac, args.include_legacy_mac)
 
 
 def fetch_all():
@@ -47,15 +72,14 @@ def fetch_data_cap():
 
 def read_json(file):
     logging.info("Reading %s", file)
-    with open(file) as fd:
-        try:
-            json_dict = json.load(fd)
-        except Exception as err:
-            logging.debug("Cannot parse file %s as JSON, reason=%s",
-                          file, err)
-            return None
-        else:
-            return json_dict
+    try:
+        json_dict = json_helper.load_file(file)
+    except Exception as err:
+        logging.debug("Cannot parse file %s as JSON, reason=%s",
+                      file, err)
+        return None
+    else:
+        return json_dict
 
 
 def get_last_tests(mac, log_dir, now_timestamp):
@@ -250,6 +274,8 @@ def parse(list_args=None):
                         help="Output heartbeats for all or a specified MAC'")
     parser.add_argument("-J", "--json", action="store_true",
                         help="Output as JSON.")
+    parser.add_argument("-P", "--parquet", action="store_true",
+                        help="Output as Parquet.")
     parser.add_argument("-o", "--output-file", nargs='?',
                         type=argparse.FileType('w'), default=sys.stdout,
                         help="Output result to file, default is to stdout'")
@@ -0,0 +1,94 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Backend used by load_file, orjson if installed, otherwise the stdlib
+backend = "json" if orjson is None else "orjson"
+
+
+def load_file_json(file):
+    with open(file) as fd:
+        return json.load(fd)
+
+
+def load_file_orjson(file):
+    with open(file, "rb") as fd:
+        content = fd.read()
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than the stdlib (e.g. NaN literals), retry with
+        # the stdlib so both backends accept the same files.
+        return json.loads(content)
+
+
+def load_file(file):
+    if backend == "orjson":
+        return load_file_orjson(file)
+    else:
+        return load_file_json(file)
+
+
+def bench(args):
+    backends = {"json": load_file_json}
+    if orjson is not None:
+        backends["orjson"] = load_file_orjson
+    else:
+        logging.warning("orjson is not installed, only benchmarking json.")
+
+    log_types = ["iperf-log", "speedtest-log", "ping-log", "wifi-scan"]
+    for log_type in log_types:
+        files = sorted([path for path in args.log_dir.rglob("*")
+                        if path.is_file() and log_type in str(path)])
+        files = files[:args.num_files]
+        if (len(files) == 0):
+            logging.warning("No %s files found! Skipping...", log_type)
+            continue
+        total_mbytes = sum([file.stat().st_size for file in files]) / 1e6
+
+        for name, load_fun in backends.items():
+            start = time.perf_counter()
+            for i in range(args.repeat):
+                for file in files:
+                    try:
+                        load_fun(file)
+                    except Exception as err:
+                        logging.debug("Cannot parse file %s as JSON, "
+                                      "reason=%s", file, err)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print("{},{},{},{:.3f},{:.3f},{:.1f}".format(
+                log_type, name, len(files), total_mbytes, elapsed,
+                total_mbytes / elapsed))
+
+
+def parse(list_args=None):
+    parser = argparse.ArgumentParser(
+        description=("Benchmark JSON decoding backends on iperf, speedtest, "
+                     "ping and wifi-scan logs."))
+    parser.add_argument("-d", "--log-dir", type=Path, default=Path("./logs"),
+                        help="Specify local log directory, default='./logs'")
+    parser.add_argument("-n", "--num-files", type=int, default=1000,
+                        help="Number of files per log type, default=1000")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of repetitions, default=3")
+    parser.add_argument("-l", "--log-level", default="warning",
+                        help="Provide logging level, default is warning'")
+    if (list_args is None):
+        return parser.parse_args()
+    else:
+        return parser.parse_args(args=list_args)
+
+
+if __name__ == '__main__':
+    args = parse()
+    logging.basicConfig(level=args.log_level.upper())
+    print("log_type,backend,num_files,total_mbytes,elapsed_s,mbytes_per_s")
+    bench(args)
@@ -0,0 +1,164 @@
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+import os
+import stage_stats
+import sys
+import tempfile
+
+
+class Task:
+    # A unit of work named (device, stage). fun is called with args followed
+    # by the results of deps, after tells which tasks have to finish first
+    # without passing their results. Ready tasks with a higher priority are
+    # started first. Local tasks run in a thread of the main process with
+    # their output printed as is, the others run in worker processes with
+    # their output printed at once when they finish. The time and memory
+    # used by each task are measured with stage_stats.measure.
+    def __init__(self, name, fun, args=(), deps=(), after=(), priority=0,
+                 local=False):
+        self.name = name
+        self.fun = fun
+        self.args = tuple(args)
+        self.deps = tuple(deps)
+        self.after = tuple(after)
+        self.priority = priority
+        self.local = local
+
+
+def get_profile_prefix(profile_dir, name):
+    if profile_dir is None:
+        return None
+    return str(profile_dir.joinpath("_".join(name)))
+
+
+def run_captured(fun, args, profile_prefix=None):
+    # Run and measure fun with stdout and stderr redirected to a temporary
+    # file, so the output of child processes and logging are captured too.
+    # Returns the result, the stats, and the output.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    with tempfile.TemporaryFile(mode="w+") as capture:
+        os.dup2(capture.fileno(), 1)
+        os.dup2(capture.fileno(), 2)
+        try:
+            result, stats = stage_stats.measure(
+                fun, args, profile_prefix=profile_prefix)
+        except BaseException:
+            # Show what the task printed before failing
+            restore_fds(saved_fds)
+            capture.seek(0)
+            sys.stderr.write(capture.read())
+            raise
+        restore_fds(saved_fds)
+        capture.seek(0)
+        return result, stats, capture.read()
+
+
+def restore_fds(saved_fds):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(saved_fds[0], 1)
+    os.dup2(saved_fds[1], 2)
+    for fd in saved_fds:
+        os.close(fd)
+    saved_fds.clear()
+
+
+def print_output(name, output):
+    # Print the output of a task as one block, each line prefixed by its name
+    if (len(output) == 0):
+        return
+    prefix = "[{}] ".format(" ".join(name))
+    sys.stdout.write("".join(prefix + line
+                             for line in output.splitlines(keepends=True)))
+    if not output.endswith("\n"):
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+
+def get_ready(waiting, results):
+    ready = [task for task in waiting.values()
+             if all(name in results for name in task.deps + task.after)]
+    return sorted(ready, key=lambda task: (-task.priority, task.name))
+
+
+def run_local(fun, args, profile_prefix=None):
+    return stage_stats.measure(fun, args, local=True,
+                               profile_prefix=profile_prefix)
+
+
+def run_serial(tasks, profile_dir=None):
+    results = dict()
+    stats = dict()
+    waiting = {task.name: task for task in tasks}
+    while (len(waiting) > 0):
+        ready = get_ready(waiting, results)
+        if (len(ready) == 0):
+            raise Exception("Tasks have unresolvable dependencies: {}".format(
+                list(waiting)))
+        task = ready[0]
+        del waiting[task.name]
+        args = task.args + tuple(results[name] for name in task.deps)
+        profile_prefix = get_profile_prefix(profile_dir, task.name)
+        if task.local:
+            results[task.name], stats[task.name] = run_local(
+                task.fun, args, profile_prefix)
+        else:
+            results[task.name], stats[task.name], output = run_captured(
+                task.fun, args, profile_prefix)
+            print_output(task.name, output)
+    return results, stats
+
+
+def run(tasks, num_workers=1, profile_dir=None):
+    # Run a list of tasks following their dependencies and return their
+    # results and stats by name. At most num_workers non-local tasks run at
+    # a time, and the remaining ones wait in the order of their priority.
+    # If profile_dir is set, profiling dumps of each task are written there.
+    if (num_workers <= 1):
+        return run_serial(tasks, profile_dir)
+
+    results = dict()
+    stats = dict()
+    waiting = {task.name: task for task in tasks}
+    running = dict()
+    with ProcessPoolExecutor(num_workers) as processes, \
+            ThreadPoolExecutor(1) as threads:
+        # Start the workers before any thread, forking a process while
+        # another thread holds a lock is unsafe.
+        processes.submit(int).result()
+
+        while (len(waiting) > 0 or len(running) > 0):
+            num_free = num_workers - len([task for task in running.values()
+                                          if not task.local])
+            for task in get_ready(waiting, results):
+                if not task.local:
+                    if (num_free == 0):
+                        continue
+                    num_free -= 1
+                del waiting[task.name]
+                args = task.args + tuple(results[name] for name in task.deps)
+                profile_prefix = get_profile_prefix(profile_dir, task.name)
+                if task.local:
+                    future = threads.submit(
+                        run_local, task.fun, args, profile_prefix)
+                else:
+                    future = processes.submit(
+                        run_captured, task.fun, args, profile_prefix)
+                running[future] = task
+            if (len(running) == 0):
+                raise Exception(
+                    "Tasks have unresolvable dependencies: {}".format(
+                        list(waiting)))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda x: running[x].name):
+                task = running.pop(future)
+                if task.local:
+                    results[task.name], stats[task.name] = future.result()
+                else:
+                    results[task.name], stats[task.name], output = (
+                        future.result())
+                    print_output(task.name, output)
+    return results, stats
@@ -0,0 +1,86 @@
+import cProfile
+import os
+import resource
+import time
+import tracemalloc
+
+
+# Counters of the running stage, e.g. the number of files and bytes read
+counters = dict()
+
+
+def count(name, value=1):
+    counters[name] = counters.get(name, 0) + value
+
+
+def reset_peak_rss():
+    # Linux only: reset the peak RSS of this process, so the peak of a stage
+    # does not include the stages that ran before it in the same process.
+    try:
+        with open("/proc/self/clear_refs", "w") as fd:
+            fd.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF):
+    # Peak RSS of this process, or with RUSAGE_CHILDREN of the largest child
+    # process it waited for. The latter cannot be reset, so it covers all
+    # children since the process started, not only those of one stage.
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def get_cpu_time(local):
+    # CPU time of the calling thread for stages sharing the main process,
+    # otherwise of the whole process and its finished child processes
+    if local:
+        return time.thread_time()
+    times = os.times()
+    return (times.user + times.system
+            + times.children_user + times.children_system)
+
+
+def measure(fun, args, local=False, profile_prefix=None):
+    # Run fun(*args) and return its result along with the wall time, CPU
+    # time, peak RSS (of this process, and of any child so far), and
+    # counters of the run. If profile_prefix is set, write a cProfile dump
+    # to {profile_prefix}.prof and a tracemalloc snapshot to
+    # {profile_prefix}.tracemalloc. Local runs share the process with other
+    # work, so their peak RSS is not reset and covers the process so far.
+    global counters
+    counters = dict()
+    if not local:
+        reset_peak_rss()
+    profiler = None
+    if profile_prefix is not None:
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+    start_wall = time.perf_counter()
+    start_cpu = get_cpu_time(local)
+
+    stats = None
+    try:
+        result = fun(*args)
+        stats = {
+            "wall_time_s": time.perf_counter() - start_wall,
+            "cpu_time_s": get_cpu_time(local) - start_cpu,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "peak_children_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN)
+        }
+    finally:
+        # Stop profiling even if fun fails, a reused worker process would
+        # keep tracing the next runs otherwise
+        if profiler is not None:
+            profiler.disable()
+            if stats is not None:
+                profiler.dump_stats(f"{profile_prefix}.prof")
+                stats["peak_traced_mb"] = (
+                    tracemalloc.get_traced_memory()[1] / 2**20)
+                tracemalloc.take_snapshot().dump(
+                    f"{profile_prefix}.tracemalloc")
+            tracemalloc.stop()
+        if stats is None:
+            counters = dict()
+    stats.update(counters)
+    return result, stats
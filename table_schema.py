@@ -0,0 +1,386 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# Declared column types of each output table:
+#   "string", "bool", "int64", "Int64" (int64 with missing values),
+#   "float64", "timestamp" (ISO string), "timestamp_ms" (epoch in ms).
+# Missing values ("NaN" strings, None, NaN) are stored as nulls.
+schemas = {
+    "throughput": {
+        "timestamp": "timestamp",
+        "mac": "string",
+        "test_uuid": "string",
+        "type": "string",
+        "direction": "string",
+        "interface": "string",
+        "host": "string",
+        "isp": "string",
+        "duration_s": "float64",
+        "transfered_mbytes": "float64",
+        "tput_mbps": "float64",
+        "std_tput_mbps": "float64",
+        "max_tput_mbps": "float64",
+        "min_tput_mbps": "float64",
+        "median_tput_mbps": "float64",
+        "25perc_tput_mbps": "float64",
+        "75perc_tput_mbps": "float64"
+    },
+    "latency": {
+        "timestamp": "timestamp",
+        "mac": "string",
+        "test_uuid": "string",
+        "type": "string",
+        "interface": "string",
+        "host": "string",
+        "isp": "string",
+        "latency_ms": "float64",
+        "jitter_ms": "float64",
+        "min_latency_ms": "float64",
+        "max_latency_ms": "float64",
+        "median_latency_ms": "float64",
+        "25perc_latency_ms": "float64",
+        "75perc_latency_ms": "float64"
+    },
+    "wifi_scan": {
+        "timestamp": "timestamp",
+        "mac": "string",
+        "test_uuid": "string",
+        "corr_test": "string",
+        "interface": "string",
+        "bssid": "string",
+        "ssid": "string",
+        "ap_name": "string",
+        "rssi_dbm": "int64",
+        "primary_channel_num": "int64",
+        "primary_freq_mhz": "int64",
+        "channel_num": "int64",
+        "center_freq0_mhz": "int64",
+        "center_freq1_mhz": "int64",
+        "bw_mhz": "int64",
+        "amendment": "string",
+        "connected": "bool",
+        "tx_power_dbm": "Int64",
+        "link_margin_db": "Int64",
+        "sta_count": "Int64",
+        "ch_utilization": "Int64",
+        "available_admission_capacity_sec": "float64",
+        "6ghz_ap_type": "string",
+        "ht_max_rx_ampdu_size_bytes": "Int64",
+        "ht_max_rx_num_stream": "Int64",
+        "ht_max_tx_num_stream": "Int64",
+        "vht_max_rx_ampdu_size_bytes": "Int64",
+        "vht_max_rx_num_stream": "Int64",
+        "vht_max_tx_num_stream": "Int64",
+        "he_6ghz_max_rx_ampdu_size_bytes": "Int64",
+        "he_max_rx_ampdu_size_extension_bytes": "Int64",
+        "he_max_rx_num_stream": "Int64",
+        "he_max_tx_num_stream": "Int64",
+        "link_mean_rssi_dbm": "float64",
+        "link_max_rssi_dbm": "Int64",
+        "link_min_rssi_dbm": "Int64",
+        "link_median_rssi_dbm": "float64",
+        "link_25perc_rssi_dbm": "float64",
+        "link_75perc_rssi_dbm": "float64",
+        "link_mean_tx_bitrate_mbps": "float64",
+        "link_max_tx_bitrate_mbps": "Int64",
+        "link_min_tx_bitrate_mbps": "Int64",
+        "link_median_tx_bitrate_mbps": "float64",
+        "link_25perc_tx_bitrate_mbps": "float64",
+        "link_75perc_tx_bitrate_mbps": "float64",
+        "link_mean_rx_bitrate_mbps": "float64",
+        "link_max_rx_bitrate_mbps": "Int64",
+        "link_min_rx_bitrate_mbps": "Int64",
+        "link_median_rx_bitrate_mbps": "float64",
+        "link_25perc_rx_bitrate_mbps": "float64",
+        "link_75perc_rx_bitrate_mbps": "float64"
+    },
+    "agg_tput": {
+        "test_uuid_concat": "string",
+        "timestamp": "timestamp",
+        "type": "string",
+        "active_wlan": "string",
+        "rssi_dbm": "float64",
+        "primary_freq_mhz": "float64",
+        "center_freq_mhz": "float64",
+        "min_freq_mhz": "float64",
+        "max_freq_mhz": "float64",
+        "bw_mhz": "float64",
+        "amendment": "string",
+        "tx_power_dbm": "float64",
+        "link_margin_db": "float64",
+        "sta_count": "float64",
+        "ch_utilization": "float64",
+        "available_admission_capacity_sec": "float64",
+        "link_mean_rssi_dbm": "float64",
+        "link_max_rssi_dbm": "float64",
+        "link_min_rssi_dbm": "float64",
+        "link_median_rssi_dbm": "float64",
+        "link_mean_tx_bitrate_mbps": "float64",
+        "link_max_tx_bitrate_mbps": "float64",
+        "link_min_tx_bitrate_mbps": "float64",
+        "link_median_tx_bitrate_mbps": "float64",
+        "link_mean_rx_bitrate_mbps": "float64",
+        "link_max_rx_bitrate_mbps": "float64",
+        "link_min_rx_bitrate_mbps": "float64",
+        "link_median_rx_bitrate_mbps": "float64"
+    },
+    "device_list": {
+        "mac": "string",
+        "rpi_id": "string",
+        "online": "bool",
+        "start_timestamp": "timestamp_ms",
+        "last_timestamp": "timestamp_ms",
+        "last_test_eth": "timestamp_ms",
+        "last_test_wlan": "timestamp_ms",
+        "data_used_gbytes": "float64",
+        "data_cap_gbytes": "float64",
+        "mean_dl_tput_mbps_eth": "float64",
+        "mean_dl_tput_mbps_wlan": "float64",
+        "mean_ul_tput_mbps_eth": "float64",
+        "mean_ul_tput_mbps_wlan": "float64",
+        "total_day": "Int64",
+        "total_consecutive_week": "Int64"
+    },
+    "heartbeat": {
+        "mac": "string",
+        "rpi_id": "string",
+        "online": "bool",
+        "start_timestamp": "timestamp_ms",
+        "last_timestamp": "timestamp_ms"
+    }
+}
+
+# Per-interface columns of agg_tput
+for iface in ["eth0", "wlan0", "wlan1"]:
+    schemas["agg_tput"][f"host_{iface}"] = "string"
+    for stat in ["mean", "std", "min", "max", "median"]:
+        schemas["agg_tput"][f"{stat}_tput_mbps_{iface}"] = "float64"
+
+# Neighboring AP columns of agg_tput
+for overlap in ["overlap_full", "overlap_primary"]:
+    for col in ["count", "num_bssid_with_power_elem",
+                "num_bssid_with_load_elem"]:
+        schemas["agg_tput"][f"{overlap}_{col}"] = "Int64"
+    for stat in ["mean", "median", "min", "max"]:
+        for col in ["rssi_dbm", "tx_power_dbm", "ch_utilization",
+                    "sta_count"]:
+            schemas["agg_tput"][f"{overlap}_{stat}_{col}"] = "float64"
+
+# Types of the columns in memory for the frames built from the parsed
+# lines, which are aggregated but not written as is. Repeated strings are
+# categoricals and integers use the smallest type holding their range.
+memory_types = {
+    "throughput": {
+        "mac": "category",
+        "type": "category",
+        "direction": "category",
+        "interface": "category",
+        "host": "category",
+        "isp": "category"
+    },
+    "latency": {
+        "mac": "category",
+        "type": "category",
+        "interface": "category",
+        "host": "category",
+        "isp": "category"
+    },
+    "wifi_scan": {
+        # Each scan has a row per BSSID
+        "timestamp": "category",
+        "mac": "category",
+        "test_uuid": "category",
+        "corr_test": "category",
+        "interface": "category",
+        "bssid": "category",
+        "ssid": "category",
+        "ap_name": "category",
+        "rssi_dbm": "int16",
+        "primary_channel_num": "int16",
+        "primary_freq_mhz": "int32",
+        "channel_num": "int16",
+        "center_freq0_mhz": "int32",
+        "center_freq1_mhz": "int32",
+        "bw_mhz": "int16",
+        "amendment": "category",
+        "tx_power_dbm": "Int16",
+        "link_margin_db": "Int16",
+        "sta_count": "Int32",
+        "ch_utilization": "Int16",
+        "6ghz_ap_type": "category",
+        "ht_max_rx_ampdu_size_bytes": "Int32",
+        "ht_max_rx_num_stream": "Int8",
+        "ht_max_tx_num_stream": "Int8",
+        "vht_max_rx_ampdu_size_bytes": "Int32",
+        "vht_max_rx_num_stream": "Int8",
+        "vht_max_tx_num_stream": "Int8",
+        "he_6ghz_max_rx_ampdu_size_bytes": "Int32",
+        "he_max_rx_ampdu_size_extension_bytes": "Int32",
+        "he_max_rx_num_stream": "Int8",
+        "he_max_tx_num_stream": "Int8",
+        "link_max_rssi_dbm": "Int16",
+        "link_min_rssi_dbm": "Int16",
+        "link_max_tx_bitrate_mbps": "Int32",
+        "link_min_tx_bitrate_mbps": "Int32",
+        "link_max_rx_bitrate_mbps": "Int32",
+        "link_min_rx_bitrate_mbps": "Int32"
+    }
+}
+
+
+def to_memory_types(df, table):
+    # Cast the columns of df to the memory types of table
+    types = memory_types.get(table, dict())
+    return df.astype({col: types[col] for col in df.columns if col in types})
+
+
+def cast_column(col, dtype):
+    match dtype:
+        case "string":
+            # Missing values may come as None, NaN or the string "NaN"
+            return col.astype("string").mask(col.isna() | (col == "NaN"))
+        case "bool":
+            if pd.api.types.is_bool_dtype(col):
+                return col.astype("boolean")
+            # Only keep actual booleans, not 1/0 or strings
+            is_bool = (col.isin([True, False])
+                       & col.astype(str).isin(["True", "False"]))
+            return col.where(is_bool).astype("boolean")
+        case "int64":
+            return col.astype("int64")
+        case "Int64":
+            return pd.to_numeric(col, errors="coerce").astype("Int64")
+        case "float64":
+            return pd.to_numeric(col, errors="coerce").astype("float64")
+        case "timestamp":
+            return pd.to_datetime(col, utc=True, format="ISO8601",
+                                  errors="coerce")
+        case "timestamp_ms":
+            return pd.to_datetime(pd.to_numeric(col, errors="coerce"),
+                                  unit="ms", utc=True)
+    return col
+
+
+def cast_frame(df, table):
+    # Cast the columns of df to the declared types of table, columns that
+    # are not declared are kept as is.
+    schema = schemas.get(table, dict())
+    return df.assign(**{
+        col: cast_column(df[col], schema[col])
+        for col in df.columns if col in schema})
+
+
+def get_arrow_type(dtype):
+    match dtype:
+        case "string":
+            return pa.string()
+        case "bool":
+            return pa.bool_()
+        case "int64" | "Int64":
+            return pa.int64()
+        case "float64":
+            return pa.float64()
+        case "timestamp":
+            return pa.timestamp("us", tz="UTC")
+        case "timestamp_ms":
+            return pa.timestamp("ms", tz="UTC")
+
+
+def to_arrow(df, table):
+    # Convert df to an Arrow table with the declared schema of table, the
+    # index is kept as a column if it is named (e.g. mac).
+    if pa is None:
+        raise Exception("pyarrow is not installed!")
+
+    if df.index.name is not None:
+        df = df.reset_index()
+    df = cast_frame(df, table)
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    schema = schemas.get(table, dict())
+    return arrow_table.cast(pa.schema([
+        (field.name, get_arrow_type(schema[field.name]))
+        if field.name in schema else field
+        for field in arrow_table.schema]), safe=False)
+
+
+def write_parquet(frames, table, output_file):
+    # Write an iterable of DataFrames to a Parquet file as row groups.
+    # Text output files (e.g. from argparse.FileType) are written through
+    # their binary buffer.
+    if pa is None:
+        raise Exception("pyarrow is not installed!")
+
+    if hasattr(output_file, "buffer"):
+        output_file = output_file.buffer
+    writer = None
+    for df in frames:
+        arrow_table = to_arrow(df, table)
+        if writer is None:
+            writer = pq.ParquetWriter(output_file, arrow_table.schema)
+        elif arrow_table.schema != writer.schema:
+            arrow_table = arrow_table.cast(writer.schema)
+        writer.write_table(arrow_table)
+    if writer is not None:
+        writer.close()
+
+
+def append_parquet(frames, table, path):
+    # Append an iterable of DataFrames to an existing Parquet file. Parquet
+    # files cannot be extended in place, so the file is rewritten with the
+    # new row groups at the end.
+    if pa is None:
+        raise Exception("pyarrow is not installed!")
+
+    existing = pq.read_table(path)
+    with pq.ParquetWriter(path, existing.schema) as writer:
+        writer.write_table(existing)
+        for df in frames:
+            writer.write_table(to_arrow(df, table).cast(existing.schema))
+
+
+def iter_frames(lines, columns, chunk_size=100000):
+    # Group an iterable of lines into DataFrames of chunk_size rows
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if (len(chunk) == 0):
+            break
+        yield pd.DataFrame.from_records(chunk, columns=columns)
+
+
+def get_format(args):
+    # Output format chosen by the -J, -N and -P options of the scripts
+    if getattr(args, "parquet", False):
+        return "parquet"
+    elif getattr(args, "ndjson", False):
+        return "ndjson"
+    elif getattr(args, "json", False):
+        return "json"
+    return "csv"
+
+
+def write_outputs(write_file, outputs):
+    # Write one table to several files at once. outputs is a dict of
+    # {fmt: path} and write_file(fmt, fd) writes the table in fmt to an open
+    # file. Each file is written in its own thread, Parquet encoding and file
+    # writes do not hold the GIL.
+    if (len(outputs) == 0):
+        return
+
+    def write_output(fmt, path):
+        with open(path, "wb" if fmt == "parquet" else "w") as fd:
+            write_file(fmt, fd)
+
+    with ThreadPoolExecutor(len(outputs)) as executor:
+        futures = [executor.submit(write_output, fmt, path)
+                   for fmt, path in outputs.items()]
+    for future in futures:
+        future.result()
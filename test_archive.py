@@ -0,0 +1,107 @@
+import archive
+import os
+import pytest
+import shutil
+import subprocess
+import zipfile
+
+
+def make_tree(directory):
+    directory.joinpath("ping-log").mkdir(parents=True)
+    directory.joinpath("wifi-scan").mkdir()
+    directory.joinpath("ping-log", "a.json").write_text("a" * 1000)
+    directory.joinpath("ping-log", "b.json").write_text("b" * 1000)
+    directory.joinpath("wifi-scan", "c.json").write_text("c" * 1000)
+
+
+def make_zip(archive_file, directory):
+    # Archive as made by "zip -ur" before the manifests were added
+    if shutil.which("zip") is None:
+        pytest.skip("zip is not installed")
+    subprocess.run(["zip", "-qr", str(archive_file.resolve()), "."],
+                   cwd=directory, check=True)
+
+
+def read_members(archive_file):
+    with zipfile.ZipFile(archive_file) as src:
+        assert src.testzip() is None
+        return {name: src.read(name) for name in src.namelist()}
+
+
+def bump(path, text):
+    # Change a file so its stamp changes even within the mtime resolution
+    path.write_text(text)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_members_like_zip(tmp_path):
+    make_tree(tmp_path.joinpath("src"))
+    make_zip(tmp_path.joinpath("base.zip"), tmp_path.joinpath("src"))
+    archive_file = tmp_path.joinpath("out.zip")
+    assert archive.update_archive(
+        archive_file, archive.list_entries(tmp_path.joinpath("src"))) == 5
+    assert read_members(archive_file) == read_members(
+        tmp_path.joinpath("base.zip"))
+    assert archive.update_archive(
+        archive_file, archive.list_entries(tmp_path.joinpath("src"))) == 0
+
+
+def test_rebuild_copies_members(tmp_path):
+    src_dir = tmp_path.joinpath("src")
+    make_tree(src_dir)
+    archive_file = tmp_path.joinpath("out.zip")
+    archive.update_archive(archive_file, archive.list_entries(src_dir))
+    bump(src_dir.joinpath("ping-log", "a.json"), "A" * 500)
+    src_dir.joinpath("wifi-scan", "d.json").write_text("d" * 1000)
+    assert archive.update_archive(
+        archive_file, archive.list_entries(src_dir)) == 2
+
+    members = read_members(archive_file)
+    assert members["ping-log/a.json"] == b"A" * 500
+    assert members["ping-log/b.json"] == b"b" * 1000
+    assert members["wifi-scan/d.json"] == b"d" * 1000
+    assert sorted(members) == sorted(archive.list_entries(src_dir))
+
+
+def test_archive_without_manifest(tmp_path):
+    # Members of deleted files are kept, and copied members keep their
+    # extra data (e.g. the timestamps written by zip)
+    src_dir = tmp_path.joinpath("src")
+    make_tree(src_dir)
+    archive_file = tmp_path.joinpath("out.zip")
+    make_zip(archive_file, src_dir)
+    with zipfile.ZipFile(archive_file) as src:
+        extras = {info.filename: info.extra for info in src.infolist()}
+    src_dir.joinpath("ping-log", "b.json").unlink()
+    bump(src_dir.joinpath("ping-log", "a.json"), "A" * 500)
+
+    archive.update_archive(archive_file, archive.list_entries(src_dir))
+    members = read_members(archive_file)
+    assert members["ping-log/a.json"] == b"A" * 500
+    assert members["ping-log/b.json"] == b"b" * 1000
+    with zipfile.ZipFile(archive_file) as src:
+        assert src.getinfo("ping-log/b.json").extra == extras[
+            "ping-log/b.json"]
+    assert archive.update_archive(
+        archive_file, archive.list_entries(src_dir)) == 0
+
+
+def test_combined_archive(tmp_path):
+    # Members copied from per-MAC archives, as in all_rawlogs.zip
+    all_entries = dict()
+    for mac in ["RPI-AAA", "RPI-BBB"]:
+        src_dir = tmp_path.joinpath("logs", mac)
+        make_tree(src_dir)
+        mac_file = tmp_path.joinpath(f"rawlogs_{mac}.zip")
+        archive.update_archive(mac_file, archive.list_entries(src_dir))
+        all_entries[f"{mac}/"] = (None, src_dir)
+        all_entries.update(
+            archive.list_archive_entries(mac_file, prefix=f"{mac}/"))
+    archive_file = tmp_path.joinpath("all.zip")
+    archive.update_archive(archive_file, all_entries)
+
+    make_zip(tmp_path.joinpath("base.zip"), tmp_path.joinpath("logs"))
+    assert read_members(archive_file) == read_members(
+        tmp_path.joinpath("base.zip"))
+    assert archive.update_archive(archive_file, all_entries) == 0
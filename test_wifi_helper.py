@@ -0,0 +1,58 @@
+import numpy as np
+import wifi_helper
+
+
+def assert_same_channels(out, expected):
+    # Compare rows of a vectorized lookup with the entries of the scalar
+    # lookup, a NaN row stands for None
+    assert out.shape == (len(expected), 5)
+    for row, entry in zip(out, expected):
+        if entry is None:
+            assert np.isnan(row).all()
+        else:
+            assert tuple(row) == entry
+
+
+def test_get_freq_codes():
+    freqs = np.arange(2300, 7200)
+    assert (list(wifi_helper.get_freq_codes(freqs))
+            == [wifi_helper.get_freq_code(freq) for freq in freqs])
+
+
+def test_get_channels_from_num():
+    ch_nums = np.arange(-2, 260)
+    for freq_code in ["2.4", "5", "6", "unknown"]:
+        assert_same_channels(
+            wifi_helper.get_channels_from_num(freq_code, ch_nums),
+            [wifi_helper.get_channel_from_num(freq_code, ch_num)
+             for ch_num in ch_nums])
+
+
+def test_get_channels_from_freq():
+    freqs = np.arange(2300, 7200)
+    for width in [0, 20, 22, 40, 80, 160, 320]:
+        assert_same_channels(
+            wifi_helper.get_channels_from_freq(freqs, width),
+            [wifi_helper.get_channel_from_freq(freq, width)
+             for freq in freqs])
+
+
+def test_get_channels_mixed():
+    # Bands and widths may differ per element
+    freqs = np.array([2412, 5180, 5955, 6000, 100, np.nan])
+    widths = np.array([22, 80, 160, 20, 20, 20])
+    assert_same_channels(
+        wifi_helper.get_channels_from_freq(freqs, widths),
+        [wifi_helper.get_channel_from_freq(2412, 22),
+         wifi_helper.get_channel_from_freq(5180, 80),
+         wifi_helper.get_channel_from_freq(5955, 160),
+         wifi_helper.get_channel_from_freq(6000, 20),
+         None, None])
+    freq_codes = np.array(["2.4", "5", "6", "unknown"])
+    ch_nums = np.array([6, 36, 1, 1])
+    assert_same_channels(
+        wifi_helper.get_channels_from_num(freq_codes, ch_nums),
+        [wifi_helper.get_channel_from_num("2.4", 6),
+         wifi_helper.get_channel_from_num("5", 36),
+         wifi_helper.get_channel_from_num("6", 1),
+         None])
@@ -1,166 +1,195 @@
 import aggregate_tput_tests
 import argparse
+from functools import partial
 import pandas as pd
 import numpy as np
 import write_csv
 from pathlib import Path
 import logging
 import sys
+import table_schema
+
+
+def write_file(df, fmt, output_file, table="tput_stats", as_records=False):
+    match fmt:
+        case "json":
+            if as_records:
+                df = df.reset_index()
+                df.to_json(output_file, orient="records")
+            else:
+                df.to_json(output_file, orient="split")
+        case "parquet":
+            # Per-MAC stats have no declared schema, their types are inferred
+            table_schema.write_parquet([df], table, output_file)
+        case _:
+            df.to_csv(output_file)
+
+
+def write_files(df, outputs, table="tput_stats", as_records=False):
+    # Write df to each {fmt: path} of outputs concurrently, table is the
+    # declared schema used for Parquet
+    table_schema.write_outputs(
+        partial(write_file, df, table=table, as_records=as_records), outputs)
 
 
 def write(df, args, as_records=False):
-    if args.json:
-        if as_records:
-            df = df.reset_index()
-            df.to_json(args.output_file, orient="records")
-        else:
-            df.to_json(args.output_file, orient="split")
-    else:
-        df.to_csv(args.output_file)
+    table = ("device_list" if args.device_list or args.mac == "all"
+             else "tput_stats")
+    write_file(df, table_schema.get_format(args), args.output_file, table,
+               as_records)
 
 
 def create_csv(agg_tput_df, by_direction=False):
     agg_tput_df["timestamp"] = pd.to_datetime(
         agg_tput_df["timestamp"], utc=True)
-    agg_tput_df["timestamp_hour"] = agg_tput_df["timestamp"].apply(
-        lambda x: x.hour)
-    agg_tput_df["timestamp_date"] = agg_tput_df["timestamp"].apply(
-        lambda x: str(x.date()))
-    agg_tput_df["timestamp_dow"] = agg_tput_df["timestamp"].apply(
-        lambda x: x.weekday())
+    agg_tput_df["timestamp_hour"] = agg_tput_df["timestamp"].dt.hour
+    agg_tput_df["timestamp_date"] = agg_tput_df["timestamp"].dt.strftime(
+        "%Y-%m-%d")
+    agg_tput_df["timestamp_dow"] = agg_tput_df["timestamp"].dt.weekday
     if by_direction:
-        agg_tput_df["direction"] = agg_tput_df["type"].apply(
-            lambda x: x.split("-")[1])
+        agg_tput_df["direction"] = agg_tput_df["type"].str.split(
+            "-").str[1]
 
     # Determine available interfaces
-    has_eth0 = "max_tput_mbps_eth0" in agg_tput_df.columns
-    has_wlan0 = "max_tput_mbps_wlan0" in agg_tput_df.columns
-    has_wlan1 = "max_tput_mbps_wlan1" in agg_tput_df.columns
+    ifaces = [iface for iface in ["eth0", "wlan0", "wlan1"]
+              if f"max_tput_mbps_{iface}" in agg_tput_df.columns]
 
     # Group by test type {iperf,speedtest}-{dl,ul}
     # or by direction {dl,ul}
-    if by_direction:
-        focus_cols = ["direction"]
-        focus_col = "direction"
-    else:
-        focus_cols = ["type"]
-        focus_col = "type"
-    if has_eth0:
-        focus_cols += ["max_tput_mbps_eth0"]
-    if has_wlan0:
-        focus_cols += ["max_tput_mbps_wlan0"]
-    if has_wlan1:
-        focus_cols += ["max_tput_mbps_wlan1"]
-    if by_direction:
-        all_tput = agg_tput_df[focus_cols].groupby(focus_col)
-    else:
-        all_tput = agg_tput_df[focus_cols].groupby("type")
+    focus_col = "direction" if by_direction else "type"
+    focus_cols = [focus_col] + [f"max_tput_mbps_{iface}" for iface in ifaces]
+    all_tput = agg_tput_df[focus_cols].groupby(focus_col)
     # Group by test type/direction and timestamp hour
     hourly_tput = agg_tput_df[focus_cols + ["timestamp_hour"]].groupby(
         [focus_col, "timestamp_hour"])
 
     # DFs
     all_tput_mean = all_tput.mean()
-    all_tput_count_day = all_tput.count().apply(lambda x: x / 24)
+    all_tput_count_day = all_tput.count() / 24
     hourly_tput_stddev = hourly_tput.mean().groupby(focus_col).std()
     hourly_count_stddev = hourly_tput.count().groupby(focus_col).std()
-    if has_eth0:
-        all_tput_mean = all_tput_mean.rename(columns={
-            "max_tput_mbps_eth0": "mean_tput_mbps_eth0"})
-        all_tput_count_day = all_tput_count_day.rename(columns={
-            "max_tput_mbps_eth0": "day_worth_of_data_eth0"})
-        hourly_tput_stddev = hourly_tput_stddev.rename(columns={
-            "max_tput_mbps_eth0": "hourly_tput_stddev_eth0"})
-        hourly_count_stddev = hourly_count_stddev.rename(columns={
-            "max_tput_mbps_eth0": "hourly_count_stddev_eth0"})
-    if has_wlan0:
+    for iface in ifaces:
+        col = f"max_tput_mbps_{iface}"
         all_tput_mean = all_tput_mean.rename(columns={
-            "max_tput_mbps_wlan0": "mean_tput_mbps_wlan0"})
+            col: f"mean_tput_mbps_{iface}"})
         all_tput_count_day = all_tput_count_day.rename(columns={
-            "max_tput_mbps_wlan0": "day_worth_of_data_wlan0"})
+            col: f"day_worth_of_data_{iface}"})
         hourly_tput_stddev = hourly_tput_stddev.rename(columns={
-            "max_tput_mbps_wlan0": "hourly_tput_stddev_wlan0"})
+            col: f"hourly_tput_stddev_{iface}"})
         hourly_count_stddev = hourly_count_stddev.rename(columns={
-            "max_tput_mbps_wlan0": "hourly_count_stddev_wlan0"})
-    if has_wlan1:
-        all_tput_mean = all_tput_mean.rename(columns={
-            "max_tput_mbps_wlan1": "mean_tput_mbps_wlan1"})
-        all_tput_count_day = all_tput_count_day.rename(columns={
-            "max_tput_mbps_wlan1": "day_worth_of_data_wlan1"})
-        hourly_tput_stddev = hourly_tput_stddev.rename(columns={
-            "max_tput_mbps_wlan1": "hourly_tput_stddev_wlan1"})
-        hourly_count_stddev = hourly_count_stddev.rename(columns={
-            "max_tput_mbps_wlan1": "hourly_count_stddev_wlan1"})
-
-    # Group by timestamp day of the week
-    cons_week = agg_tput_df[
-        [focus_col, "timestamp_date", "timestamp_dow"]].groupby(
-        [focus_col, "timestamp_dow"]).apply(
-        lambda x: x.nunique())
-    available_dow = agg_tput_df["timestamp_dow"].unique()
-    for i in range(0, 7):
-        if i not in available_dow:
-            for focus_idx in agg_tput_df[focus_col].unique():
-                cons_week.loc[(focus_idx, i), :] = 0
+            col: f"hourly_count_stddev_{iface}"})
+
+    # Number of days with tests on each day of the week, the consecutive
+    # weeks are the minimum over the days of the week. Days of the week
+    # without any test count as zero for all test types.
+    cons_week = agg_tput_df.groupby(
+        [focus_col, "timestamp_dow"])["timestamp_date"].nunique()
     logging.info(cons_week)
-    cons_week = cons_week["timestamp_date"].groupby(focus_col).min()
+    cons_week = cons_week.groupby(focus_col).min()
+    if (agg_tput_df["timestamp_dow"].nunique() < 7):
+        cons_week[:] = 0
 
     out_df = pd.concat(
         [all_tput_mean, all_tput_count_day, hourly_tput_stddev,
          hourly_count_stddev], axis=1)
-    out_df["total_day"] = 0
-    out_df["total_consecutive_week"] = 0
-    for idx in out_df.index:
-        out_df.loc[idx, "total_day"] = len(
-            agg_tput_df[agg_tput_df[focus_col] == idx][
-                "timestamp_date"].unique())
-        out_df.loc[idx, "total_consecutive_week"] = cons_week[idx]
+    out_df["total_day"] = agg_tput_df.groupby(focus_col)[
+        "timestamp_date"].nunique().reindex(out_df.index)
+    out_df["total_consecutive_week"] = cons_week.reindex(out_df.index)
     return out_df
 
 
-def combine_device_list(device_list_df, agg_tput_dfs, remove_empty=False):
+# Columns added to the device list, in order
+summary_cols = ["mean_dl_tput_mbps_eth", "mean_dl_tput_mbps_wlan",
+                "mean_ul_tput_mbps_eth", "mean_ul_tput_mbps_wlan",
+                "total_day", "total_consecutive_week"]
+
+
+def get_device_summaries(agg_tput_dfs):
+    # Stats of each device shown in the device list, computed in one grouped
+    # pass over the aggregate throughput tests of all devices. agg_tput_dfs
+    # is a dict of {mac: agg_tput_df}, returns a DF indexed by MAC.
+    if (len(agg_tput_dfs) == 0):
+        return pd.DataFrame(columns=summary_cols)
+    fleet = list()
+    for agg_tput_df in agg_tput_dfs.values():
+        # wlan1 is used over wlan0 if the device has both, missing
+        # interfaces are all NaN
+        wlan = ("wlan1" if "max_tput_mbps_wlan1" in agg_tput_df.columns
+                else "wlan0")
+        fleet.append(agg_tput_df.reindex(columns=[
+            "type", "timestamp", "max_tput_mbps_eth0",
+            f"max_tput_mbps_{wlan}"]).set_axis(
+                ["type", "timestamp", "eth", "wlan"], axis=1))
+    fleet_df = pd.concat(fleet, keys=list(agg_tput_dfs), names=["mac"])
+    fleet_df = fleet_df.reset_index(level="mac")
+    fleet_df["direction"] = fleet_df["type"].str.split("-").str[1]
+    timestamp = pd.to_datetime(fleet_df["timestamp"], utc=True)
+    fleet_df["timestamp_date"] = timestamp.dt.floor("D")
+    fleet_df["timestamp_dow"] = timestamp.dt.weekday
+    by_direction = fleet_df.groupby(["mac", "direction"], sort=False)
+
+    # Mean throughput of each direction
+    means = by_direction[["eth", "wlan"]].mean().unstack("direction")
+    # Number of days with tests, and number of days with tests on each day
+    # of the week, the consecutive weeks are the minimum over the days of
+    # the week. Days of the week without any test count as zero.
+    total_day = by_direction["timestamp_date"].nunique().unstack("direction")
+    cons_week = fleet_df.groupby(
+        ["mac", "direction", "timestamp_dow"], sort=False)[
+        "timestamp_date"].nunique().groupby(["mac", "direction"]).min()
+    cons_week = cons_week.unstack("direction")
+    num_dow = fleet_df.groupby("mac", sort=False)["timestamp_dow"].nunique()
+    cons_week[num_dow.reindex(cons_week.index) < 7] = 0
+
+    out_df = pd.DataFrame(index=pd.Index(list(agg_tput_dfs), name="mac"))
+    for direction in ["dl", "ul"]:
+        for iface in ["eth", "wlan"]:
+            out_df[f"mean_{direction}_tput_mbps_{iface}"] = (
+                means[(iface, direction)] if (iface, direction) in means
+                else np.nan)
+    # The longer of the DL and UL tests
+    out_df["total_day"] = total_day.reindex(
+        columns=["dl", "ul"]).max(axis=1).astype("Int64")
+    out_df["total_consecutive_week"] = cons_week.reindex(
+        columns=["dl", "ul"]).max(axis=1).astype("Int64")
+    return out_df[summary_cols]
+
+
+def get_device_summary(agg_tput_df):
+    # Stats of a device shown in the device list, computed from its
+    # aggregate throughput tests
+    summary = get_device_summaries({"": agg_tput_df}).iloc[0]
+    return {col: (None if pd.isna(value) else value)
+            for col, value in summary.items()}
+
+
+def combine_device_summaries(device_list_df, summaries, remove_empty=False):
+    # Add the summaries of each MAC to the device list with one join,
+    # summaries is either the output of get_device_summaries or a dict of
+    # {mac: get_device_summary}
     if isinstance(device_list_df, list):
         device_list_df = pd.DataFrame.from_dict(device_list_df)
     device_list_df = device_list_df.set_index("mac")
+    if isinstance(summaries, dict):
+        summaries = pd.DataFrame.from_dict(
+            summaries, orient="index", columns=summary_cols)
+    summaries = summaries.astype({
+        "total_day": "Int64", "total_consecutive_week": "Int64",
+        **{col: "float64" for col in summary_cols[:4]}})
+
+    # Remove rows with non-existent tput data, the join drops the index
+    # name if there are no summaries
+    out_df = device_list_df.join(summaries,
+                                 how="inner" if remove_empty else "left")
+    out_df = out_df.rename_axis("mac")
     col_index = device_list_df.shape[1] - 1
-    col_to_add = ["mean_dl_tput_mbps_eth", "mean_dl_tput_mbps_wlan",
-                  "mean_ul_tput_mbps_eth", "mean_ul_tput_mbps_wlan",
-                  "total_day", "total_consecutive_week"]
-    for i in range(len(col_to_add)):
-        device_list_df.insert(col_index + i, col_to_add[i], None)
-
-    for mac in device_list_df.index:
-        if mac in agg_tput_dfs:
-            out_df = create_csv(agg_tput_dfs[mac], by_direction=True)
-            device_list_df.loc[mac, "total_day"] = max(
-                out_df.loc["dl", "total_day"],
-                out_df.loc["ul", "total_day"])
-            device_list_df.loc[mac, "total_consecutive_week"] = max(
-                out_df.loc["dl", "total_consecutive_week"],
-                out_df.loc["ul", "total_consecutive_week"])
-            if "mean_tput_mbps_eth0" in out_df.columns:
-                device_list_df.loc[mac, [
-                    "mean_dl_tput_mbps_eth",
-                    "mean_ul_tput_mbps_eth"]] = (
-                        out_df.loc["dl", "mean_tput_mbps_eth0"],
-                        out_df.loc["ul", "mean_tput_mbps_eth0"])
-            if "mean_tput_mbps_wlan1" in out_df.columns:
-                device_list_df.loc[mac, [
-                    "mean_dl_tput_mbps_wlan",
-                    "mean_ul_tput_mbps_wlan"]] = (
-                        out_df.loc["dl", "mean_tput_mbps_wlan1"],
-                        out_df.loc["ul", "mean_tput_mbps_wlan1"])
-            elif "mean_tput_mbps_wlan0" in out_df.columns:
-                device_list_df.loc[mac, [
-                    "mean_dl_tput_mbps_wlan",
-                    "mean_ul_tput_mbps_wlan"]] = (
-                        out_df.loc["dl", "mean_tput_mbps_wlan0"],
-                        out_df.loc["ul", "mean_tput_mbps_wlan0"])
-        elif remove_empty:
-            # Remove row with non-existent tput data
-            device_list_df = device_list_df[device_list_df.index != mac]
-
-    return device_list_df
+    columns = list(device_list_df.columns)
+    return out_df[columns[:col_index] + summary_cols + columns[col_index:]]
+
+
+def combine_device_list(device_list_df, agg_tput_dfs, remove_empty=False):
+    return combine_device_summaries(
+        device_list_df, get_device_summaries(agg_tput_dfs), remove_empty)
 
 
 def data_stats(args):
@@ -219,6 +248,8 @@ def parse(list_args=None):
                               "be in ISO format, ex: 2024-06-14T17:00-0500)"))
     parser.add_argument("-J", "--json", action="store_true",
                         help="Output as JSON.")
+    parser.add_argument("-P", "--parquet", action="store_true",
+                        help="Output as Parquet.")
     parser.add_argument("--by-direction", action="store_true",
                         help=("Use only test direction (DL/UL) instead of "
                               "test type + direction."))
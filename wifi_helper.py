@@ -1,3 +1,6 @@
+import numpy as np
+
+
 cell_table_2_4 = [
     # ( Channel num, Center freq MHz, Start freq MHz, End freq MHz, Width MHz)
     (1, 2412, 2401, 2423, 22),
@@ -226,37 +229,131 @@ def get_freq_code(freq):
             return "unknown"
 
 
-def get_channel_from_num(freq_code, ch_num):
-    ch = None
-    # cell_table = list()
-    match freq_code:
-        case "2.4":
-            cell_table = cell_table_2_4
-        case "5":
-            cell_table = cell_table_5
-        case "6":
-            cell_table = cell_table_6
+cell_tables = {
+    "2.4": cell_table_2_4,
+    "5": cell_table_5,
+    "6": cell_table_6
+}
+cell_arrays = {freq_code: np.array(cell_table, dtype=float)
+               for freq_code, cell_table in cell_tables.items()}
 
-    ch_list = [x for x in cell_table if x[0] == ch_num]
-    if (len(ch_list) > 0):
-        ch = ch_list[0]
-    return ch
+# Channel indexes compiled from the cell tables, the first entry in the table
+# wins if several match, as in a linear search.
+# (freq code, channel num) -> entry
+channel_num_index = dict()
+# (freq code, width, freq) -> entry, for each freq in [start, end) MHz
+channel_freq_index = dict()
+# freq code -> lookup array of channel num to row in cell_arrays, -1 if none
+channel_num_luts = dict()
+# (freq code, width) -> (start freq, lookup array of freq to row in
+# cell_arrays, -1 if none)
+channel_freq_luts = dict()
+
+for freq_code, cell_table in cell_tables.items():
+    channel_num_luts[freq_code] = np.full(
+        max([x[0] for x in cell_table]) + 1, -1)
+    for row, entry in enumerate(cell_table):
+        if (freq_code, entry[0]) not in channel_num_index:
+            channel_num_index[(freq_code, entry[0])] = entry
+            channel_num_luts[freq_code][entry[0]] = row
+
+    for width in sorted(set([x[4] for x in cell_table])):
+        entries = [(row, x) for row, x in enumerate(cell_table)
+                   if x[4] == width]
+        start = min([x[2] for row, x in entries])
+        lut = np.full(max([x[3] for row, x in entries]) - start, -1)
+        for row, entry in entries:
+            for freq in range(entry[2], entry[3]):
+                if (freq_code, width, freq) not in channel_freq_index:
+                    channel_freq_index[(freq_code, width, freq)] = entry
+                    lut[freq - start] = row
+        channel_freq_luts[(freq_code, width)] = (start, lut)
+
+
+def get_channel_from_num(freq_code, ch_num):
+    return channel_num_index.get((freq_code, ch_num))
 
 
 def get_channel_from_freq(freq, width):
-    ch = None
-    cell_table = list()
-    freq_code = get_freq_code(freq)
-    match freq_code:
-        case "2.4":
-            cell_table = cell_table_2_4
-        case "5":
-            cell_table = cell_table_5
-        case "6":
-            cell_table = cell_table_6
+    return channel_freq_index.get((get_freq_code(freq), width, freq))
+
+
+def get_freq_codes(freqs):
+    # Vectorized get_freq_code over an array of freqs
+    freqs = np.asarray(freqs, dtype=float)
+    is_int = freqs == np.floor(freqs)
+    return np.select(
+        [is_int & (freqs >= 2401) & (freqs < 2495),
+         is_int & (freqs >= 5150) & (freqs < 5925),
+         is_int & (freqs >= 5926) & (freqs < 7125)],
+        ["2.4", "5", "6"],
+        default="unknown")
+
+
+def get_channels_from_num(freq_codes, ch_nums):
+    # Vectorized get_channel_from_num, returns an array of channel entries
+    # (one row per input) with NaN rows where no channel is found.
+    ch_nums = np.asarray(ch_nums, dtype=float)
+    freq_codes = np.broadcast_to(np.asarray(freq_codes), ch_nums.shape)
+    out = np.full(ch_nums.shape + (5,), np.nan)
+    for freq_code, lut in channel_num_luts.items():
+        mask = ((freq_codes == freq_code)
+                & (ch_nums >= 0) & (ch_nums < len(lut))
+                & (ch_nums == np.floor(ch_nums)))
+        rows = lut[ch_nums[mask].astype(int)]
+        found = rows >= 0
+        out[np.flatnonzero(mask)[found]] = cell_arrays[freq_code][
+            rows[found]]
+    return out
+
+
+def get_channels_from_freq(freqs, widths):
+    # Vectorized get_channel_from_freq, returns an array of channel entries
+    # (one row per input) with NaN rows where no channel is found.
+    freqs = np.asarray(freqs, dtype=float)
+    widths = np.broadcast_to(np.asarray(widths), freqs.shape)
+    freq_codes = get_freq_codes(freqs)
+    out = np.full(freqs.shape + (5,), np.nan)
+    for (freq_code, width), (start, lut) in channel_freq_luts.items():
+        mask = ((freq_codes == freq_code) & (widths == width)
+                & (freqs >= start) & (freqs < start + len(lut)))
+        rows = lut[(freqs[mask] - start).astype(int)]
+        found = rows >= 0
+        out[np.flatnonzero(mask)[found]] = cell_arrays[freq_code][
+            rows[found]]
+    return out
+
+
+def get_byte_max_num_stream(mcs_byte):
+    # Highest stream (1-4) in a byte of 2-bit VHT/HE MCS map fields that is
+    # supported (field != 3), 0 if none
+    num_stream = 0
+    for i in range(4):
+        if (((mcs_byte >> (i * 2)) & 3) != 3):
+            num_stream = i + 1
+    return num_stream
+
+
+# Max supported stream of each byte of a VHT/HE MCS map
+mcs_map_num_stream_table = [get_byte_max_num_stream(val)
+                            for val in range(256)]
+
+
+def get_max_num_stream(mcs_map):
+    # Max spatial stream supported by a 16-bit VHT/HE MCS map, or None
+    num_stream = mcs_map_num_stream_table[(mcs_map >> 8) & 255]
+    if (num_stream > 0):
+        return num_stream + 4
+    num_stream = mcs_map_num_stream_table[mcs_map & 255]
+    if (num_stream > 0):
+        return num_stream
+    return None
+
 
-    ch_list = [x for x in cell_table
-               if freq in range(x[2], x[3]) and x[4] == width]
-    if (len(ch_list) > 0):
-        ch = ch_list[0]
-    return ch
+def get_ht_max_num_stream(rx_mcs_bitmask):
+    # Max spatial stream of the HT RX MCS bitmask, one byte per stream for
+    # up to 4 streams, or None
+    mcs_mask = rx_mcs_bitmask & 0xffffffff
+    if (mcs_mask > 0):
+        return (mcs_mask.bit_length() + 7) // 8
+    return None
@@ -1,17 +1,33 @@
 import argparse
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import csv
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+import hashlib
+from itertools import chain
 import json
+import json_helper
 import logging
+import math
+from multiprocessing import Pool
 import numpy as np
+import os
+import pandas as pd
 from pathlib import Path
 import re
+import sqlite3
+import stage_stats
 import sys
+import table_schema
 import wifi_helper
 
 
 re_dbm = re.compile(r"([-\d\.]+) dBm")
 re_mbps = re.compile(r"([-\d\.]+) MBit/s")
+re_file_date = re.compile(r"^(\d{4}-\d{2}-\d{2})")
 
 
 def dbm_to_mw(dbm):
@@ -22,6 +38,90 @@ def mw_to_dbm(mw):
     return 10 * np.log10(mw)
 
 
+def lerp(a, b, t):
+    # Linear interpolation, computed the same way as numpy's percentile
+    diff_b_a = b - a
+    return np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
+
+
+def get_stats(values):
+    # Summary statistics of values in one pass over a single sorted copy,
+    # ignoring NaN. Same results as the np.nan* functions, all NaN if there
+    # are no values.
+    arr = np.asarray(values, dtype=float)
+    is_valid = ~np.isnan(arr)
+    num = is_valid.sum()
+    if (num == 0):
+        return {key: np.nan for key in [
+            "mean", "std", "min", "max", "median", "25perc", "75perc"]}
+
+    # Sum with NaN zeroed in place, in the same order as np.nanmean/nanstd
+    zeroed = np.where(is_valid, arr, 0)
+    mean = zeroed.sum() / num
+    dev = np.where(is_valid, zeroed - mean, 0)
+    std = np.sqrt((dev * dev).sum() / num)
+    arr = np.sort(arr[is_valid])
+    perc = np.percentile(arr, [25, 75])
+    return {
+        "mean": mean,
+        "std": std,
+        "min": arr[0],
+        "max": arr[-1],
+        "median": (arr[(num - 1) // 2] + arr[num // 2]) / 2,
+        "25perc": perc[0],
+        "75perc": perc[1]
+    }
+
+
+def get_stats_batch(values_list):
+    # Batched get_stats over many samples, e.g. of every file, computed on a
+    # NaN-padded 2D array. Returns a dict of arrays with one entry per
+    # samples, NaN for empty samples. Mean and std may differ from
+    # get_stats in the last digits due to summation order.
+    if (len(values_list) == 0):
+        return {key: np.empty(0) for key in [
+            "mean", "std", "min", "max", "median", "25perc", "75perc"]}
+
+    max_len = max([len(values) for values in values_list])
+    arr = np.full((len(values_list), max(max_len, 1)), np.nan)
+    for i, values in enumerate(values_list):
+        arr[i, :len(values)] = values
+
+    # NaN are sorted last, so valid values are at the start of each row
+    arr.sort(axis=1)
+    num = (~np.isnan(arr)).sum(axis=1)
+    has_values = num > 0
+    last = np.maximum(num - 1, 0)
+    rows = np.arange(arr.shape[0])
+    sums = np.nansum(arr, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(has_values, sums / num, np.nan)
+        dev = arr - mean[:, np.newaxis]
+        std = np.where(
+            has_values, np.sqrt(np.nansum(dev * dev, axis=1) / num), np.nan)
+
+    out = {
+        "mean": mean,
+        "std": std,
+        "min": np.where(has_values, arr[rows, 0], np.nan),
+        "max": np.where(has_values, arr[rows, last], np.nan),
+        "median": np.where(
+            has_values,
+            (arr[rows, last // 2] + arr[rows, num // 2]) / 2,
+            np.nan)
+    }
+    for perc in [25, 75]:
+        index = last * (perc / 100)
+        prev_index = np.floor(index).astype(int)
+        next_index = np.minimum(prev_index + 1, last)
+        out[f"{perc}perc"] = np.where(
+            has_values,
+            lerp(arr[rows, prev_index], arr[rows, next_index],
+                 index - prev_index),
+            np.nan)
+    return out
+
+
 def dict_reader(input_dict, nan_val, *dict_args):
     curr = input_dict
 
@@ -34,6 +134,63 @@ def dict_reader(input_dict, nan_val, *dict_args):
     return curr
 
 
+class Line(tuple):
+    """Parsed line of an output table.
+
+    Values are stored in the column order of the table schema declared in
+    table_schema, with float NaN for missing numbers, and can be read by
+    column name. Subclasses set the table name.
+    """
+
+    __slots__ = ()
+    table = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dtypes = table_schema.schemas[cls.table]
+        cls.columns = tuple(cls.dtypes)
+        cls.index = {key: i for i, key in enumerate(cls.columns)}
+
+    def __new__(cls, values):
+        return super().__new__(cls, values)
+
+    @classmethod
+    def from_dict(cls, line):
+        return cls(line[key] for key in cls.columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.index[key]
+        return super().__getitem__(key)
+
+    def to_dict(self):
+        # Values as written to CSV and JSON, "NaN" for missing numbers
+        return {key: "NaN" if value != value else value
+                for key, value in zip(self.columns, self)}
+
+
+class TputLine(Line):
+    __slots__ = ()
+    table = "throughput"
+
+
+class LatLine(Line):
+    __slots__ = ()
+    table = "latency"
+
+
+class ScanLine(Line):
+    __slots__ = ()
+    table = "wifi_scan"
+
+
+line_types = {
+    "throughput": TputLine,
+    "latency": LatLine,
+    "wifi_scan": ScanLine
+}
+
+
 def get_tput_line(mac, json_dict):
     outarr = list()
     if ("error" in json_dict):
@@ -41,9 +198,8 @@ def get_tput_line(mac, json_dict):
 
     if ("start" in json_dict):
         # iperf file
-        iperf_tputs = list(map(
-            lambda x: x["sum"]["bits_per_second"] / 1e6,
-            json_dict["intervals"]))
+        iperf_stats = get_stats([x["sum"]["bits_per_second"] / 1e6
+                                 for x in json_dict["intervals"]])
         outarr.append({
             "timestamp": datetime.fromtimestamp(
                 json_dict["start"]["timestamp"]["timesecs"]
@@ -68,12 +224,12 @@ def get_tput_line(mac, json_dict):
                 json_dict["end"]["sum_received"]["bytes"] / 1e6,
             "tput_mbps":
                 json_dict["end"]["sum_received"]["bits_per_second"] / 1e6,
-            "std_tput_mbps": np.nanstd(iperf_tputs),
-            "max_tput_mbps": max(iperf_tputs),
-            "min_tput_mbps": min(iperf_tputs),
-            "median_tput_mbps": np.nanmedian(iperf_tputs),
-            "25perc_tput_mbps": np.nanpercentile(iperf_tputs, 25),
-            "75perc_tput_mbps": np.nanpercentile(iperf_tputs, 75)
+            "std_tput_mbps": iperf_stats["std"],
+            "max_tput_mbps": iperf_stats["max"],
+            "min_tput_mbps": iperf_stats["min"],
+            "median_tput_mbps": iperf_stats["median"],
+            "25perc_tput_mbps": iperf_stats["25perc"],
+            "75perc_tput_mbps": iperf_stats["75perc"]
         })
     elif ("type" in json_dict):
         # new speedtest file
@@ -94,7 +250,7 @@ def get_tput_line(mac, json_dict):
             "duration_s": json_dict["download"]["elapsed"] / 1e3,
             "transfered_mbytes": json_dict["download"]["bytes"] / 1e6,
             "tput_mbps": json_dict["download"]["bandwidth"] * 8 / 1e6,
-            "std_tput_mbps": "NaN",
+            "std_tput_mbps": np.nan,
             "max_tput_mbps": json_dict["download"]["bandwidth"] * 8 / 1e6,
             "min_tput_mbps": json_dict["download"]["bandwidth"] * 8 / 1e6,
             "median_tput_mbps": json_dict["download"]["bandwidth"] * 8 / 1e6,
@@ -113,7 +269,7 @@ def get_tput_line(mac, json_dict):
             "duration_s": json_dict["upload"]["elapsed"] / 1e3,
             "transfered_mbytes": json_dict["upload"]["bytes"] / 1e6,
             "tput_mbps": json_dict["upload"]["bandwidth"] * 8 / 1e6,
-            "std_tput_mbps": "NaN",
+            "std_tput_mbps": np.nan,
             "max_tput_mbps": json_dict["upload"]["bandwidth"] * 8 / 1e6,
             "min_tput_mbps": json_dict["upload"]["bandwidth"] * 8 / 1e6,
             "median_tput_mbps": json_dict["upload"]["bandwidth"] * 8 / 1e6,
@@ -137,10 +293,10 @@ def get_tput_line(mac, json_dict):
             "interface": "eth0",
             "host": json_dict["server"]["host"],
             "isp": json_dict["client"]["isp"],
-            "duration_s": "NaN",
+            "duration_s": np.nan,
             "transfered_mbytes": json_dict["bytes_received"] / 1e6,
             "tput_mbps": json_dict["download"] / 1e6,
-            "std_tput_mbps": "NaN",
+            "std_tput_mbps": np.nan,
             "max_tput_mbps": json_dict["download"] / 1e6,
             "min_tput_mbps": json_dict["download"] / 1e6,
             "median_tput_mbps": json_dict["download"] / 1e6,
@@ -156,10 +312,10 @@ def get_tput_line(mac, json_dict):
             "interface": "eth0",
             "host": json_dict["server"]["host"],
             "isp": json_dict["client"]["isp"],
-            "duration_s": "NaN",
+            "duration_s": np.nan,
             "transfered_mbytes": json_dict["bytes_sent"] / 1e6,
             "tput_mbps": json_dict["upload"] / 1e6,
-            "std_tput_mbps": "NaN",
+            "std_tput_mbps": np.nan,
             "max_tput_mbps": json_dict["upload"] / 1e6,
             "min_tput_mbps": json_dict["upload"] / 1e6,
             "median_tput_mbps": json_dict["upload"] / 1e6,
@@ -168,7 +324,7 @@ def get_tput_line(mac, json_dict):
         })
 
     logging.debug(outarr)
-    return outarr
+    return [TputLine.from_dict(line) for line in outarr]
 
 
 def get_lat_line(mac, json_dict):
@@ -205,12 +361,12 @@ def get_lat_line(mac, json_dict):
                 str(json_dict["start"]["connecting_to"]["port"])),
             "isp": "unknown",
             "latency_ms": iperf_mean_lat,
-            "jitter_ms": "NaN",
+            "jitter_ms": np.nan,
             "min_latency_ms": iperf_min_lat,
             "max_latency_ms": iperf_max_lat,
-            "median_latency_ms": "NaN",
-            "25perc_latency_ms": "NaN",
-            "75perc_latency_ms": "NaN"
+            "median_latency_ms": np.nan,
+            "25perc_latency_ms": np.nan,
+            "75perc_latency_ms": np.nan
         })
     elif ("type" in json_dict):
         # new speedtest file
@@ -274,44 +430,41 @@ def get_lat_line(mac, json_dict):
             iface = json_dict["interface"]
             test_uuid = json_dict["extra"]["test_uuid"]
             corr_test = "ping-" + json_dict["extra"]["corr_test"]
+            entries = list()
             for entry in json_dict["pings"]:
                 entry["responses"] = list(
                     filter(lambda x: ("type" in x and x["type"] == "reply"),
                            entry["responses"]))
                 if (len(entry["responses"]) > 0):
-                    latencies_ms = list(map(
-                        lambda x: x["time_ms"] if "time_ms" in x else "NaN",
-                        entry["responses"]))
-                    latencies_ms = [lat for lat in latencies_ms
-                                    if lat != "NaN" and lat is not None]
-                    lat_median = ("NaN" if len(latencies_ms) == 0
-                                  else np.nanmedian(latencies_ms))
-                    lat_25perc = ("NaN" if len(latencies_ms) == 0
-                                  else np.nanpercentile(latencies_ms, 25))
-                    lat_75perc = ("NaN" if len(latencies_ms) == 0
-                                  else np.nanpercentile(latencies_ms, 75))
-                    outarr.append({
-                        "timestamp": datetime.fromisoformat(
-                            entry["responses"][0]["timestamp"]
-                        ).astimezone().isoformat(timespec="seconds"),
-                        "mac": mac,
-                        "test_uuid": test_uuid,
-                        "type": corr_test,
-                        "interface": iface,
-                        "host": entry["destination"],
-                        "isp": "unknown",
-                        "latency_ms": dict_reader(
-                            entry, "NaN", "round_trip_ms_avg"),
-                        "jitter_ms": dict_reader(
-                            entry, "NaN", "round_trip_ms_stddev"),
-                        "min_latency_ms": dict_reader(
-                            entry, "NaN", "round_trip_ms_min"),
-                        "max_latency_ms": dict_reader(
-                            entry, "NaN", "round_trip_ms_max"),
-                        "median_latency_ms": lat_median,
-                        "25perc_latency_ms": lat_25perc,
-                        "75perc_latency_ms": lat_75perc
-                    })
+                    entries.append(entry)
+            # Latency stats of every destination in one batch
+            lat_stats = get_stats_batch([
+                [x["time_ms"] for x in entry["responses"]
+                 if "time_ms" in x and x["time_ms"] is not None]
+                for entry in entries])
+            for i, entry in enumerate(entries):
+                outarr.append({
+                    "timestamp": datetime.fromisoformat(
+                        entry["responses"][0]["timestamp"]
+                    ).astimezone().isoformat(timespec="seconds"),
+                    "mac": mac,
+                    "test_uuid": test_uuid,
+                    "type": corr_test,
+                    "interface": iface,
+                    "host": entry["destination"],
+                    "isp": "unknown",
+                    "latency_ms": dict_reader(
+                        entry, np.nan, "round_trip_ms_avg"),
+                    "jitter_ms": dict_reader(
+                        entry, np.nan, "round_trip_ms_stddev"),
+                    "min_latency_ms": dict_reader(
+                        entry, np.nan, "round_trip_ms_min"),
+                    "max_latency_ms": dict_reader(
+                        entry, np.nan, "round_trip_ms_max"),
+                    "median_latency_ms": lat_stats["median"][i],
+                    "25perc_latency_ms": lat_stats["25perc"][i],
+                    "75perc_latency_ms": lat_stats["75perc"][i]
+                })
     elif ("beacons" in json_dict):
         pass
     else:
@@ -327,7 +480,7 @@ def get_lat_line(mac, json_dict):
             "host": json_dict["server"]["host"],
             "isp": json_dict["client"]["isp"],
             "latency_ms": json_dict["ping"],
-            "jitter_ms": "NaN",
+            "jitter_ms": np.nan,
             "min_latency_ms": json_dict["ping"],
             "max_latency_ms": json_dict["ping"],
             "median_latency_ms": json_dict["ping"],
@@ -336,7 +489,263 @@ def get_lat_line(mac, json_dict):
         })
 
     logging.debug(outarr)
-    return outarr
+    return [LatLine.from_dict(line) for line in outarr]
+
+
+def decode_ht_op(outtemp, ht_op, ctx):
+    outtemp["amendment"] = "11n"
+    logging.debug(ht_op)
+
+    # Attempt to resolve bandwidth
+    if (ht_op["sta_channel_width"] == 1):
+        ch = wifi_helper.get_channel_from_freq(
+            outtemp["primary_freq_mhz"], 40)
+        if (ch is not None):
+            outtemp["channel_num"] = ch[0]
+            outtemp["center_freq0_mhz"] = ch[1]
+            outtemp["bw_mhz"] = 40
+
+
+def decode_ht_caps(outtemp, ht_caps, ctx):
+    outtemp["amendment"] = "11n"
+    logging.debug(ht_caps)
+
+    # Max HT AMPDU size
+    if ("maximum_rx_a_mpdu_length" in ht_caps):
+        ctx["ampdu_exponent"] = ht_caps["maximum_rx_a_mpdu_length"]
+        outtemp["ht_max_rx_ampdu_size_bytes"] = (
+            pow(2, 13 + ht_caps["maximum_rx_a_mpdu_length"]) - 1)
+
+    # Max HT RX spatial stream
+    if ("rx_mcs_bitmask" in ht_caps):
+        num_stream = wifi_helper.get_ht_max_num_stream(
+            ht_caps["rx_mcs_bitmask"])
+        if (num_stream is not None):
+            outtemp["ht_max_rx_num_stream"] = num_stream
+
+    # Max HT TX spatial stream
+    if ("tx_mcs_set_defined" in ht_caps
+            and "tx_rx_mcs_set_not_equal" in ht_caps
+            and ht_caps["tx_mcs_set_defined"] == 1):
+        if (ht_caps["tx_rx_mcs_set_not_equal"] == 0):
+            outtemp["ht_max_tx_num_stream"] = outtemp[
+                "ht_max_rx_num_stream"]
+        elif ("tx_max_ss_supported" in ht_caps):
+            outtemp["ht_max_tx_num_stream"] = (
+                ht_caps["tx_max_ss_supported"] + 1)
+
+
+def decode_vht_op(outtemp, vht_op, ctx):
+    outtemp["amendment"] = "11ac"
+    logging.debug(vht_op)
+
+    # Attempt to further resolve bandwidth > 40 MHz
+    match vht_op["channel_width"]:
+        case 0 | 2:
+            # 20 or 40 MHz, or 160 MHz (deprecated)
+            freq_bw0 = wifi_helper.get_channel_from_num(
+                ctx["freq_code"], vht_op["channel_center_freq_0"])
+            if (freq_bw0 is not None):
+                outtemp["channel_num"] = freq_bw0[0]
+                outtemp["center_freq0_mhz"] = freq_bw0[1]
+                outtemp["bw_mhz"] = freq_bw0[4]
+
+        case 1:
+            # 80 or 160 or 80+80 MHz
+            freq_bw0 = wifi_helper.get_channel_from_num(
+                ctx["freq_code"], vht_op["channel_center_freq_0"])
+            freq_bw1 = wifi_helper.get_channel_from_num(
+                ctx["freq_code"], vht_op["channel_center_freq_1"])
+
+            if (freq_bw0 is not None and freq_bw1 is not None):
+                # This might be 160 or 80+80 MHz
+                outtemp["bw_mhz"] = 160
+                outtemp["center_freq0_mhz"] = freq_bw0[1]
+                outtemp["center_freq1_mhz"] = freq_bw1[1]
+                if (freq_bw1[4] == 80):
+                    # Must be 80+80 MHz
+                    # Use the first channel segment number,
+                    # may change later
+                    outtemp["channel_num"] = freq_bw0[0]
+                elif (freq_bw1[4] == 160):
+                    # Must be 160 MHz
+                    # Use the second channel segment number
+                    outtemp["channel_num"] = freq_bw1[0]
+            elif (freq_bw0 is not None):
+                # This must be 80 MHz
+                outtemp["channel_num"] = freq_bw0[0]
+                outtemp["center_freq0_mhz"] = freq_bw0[1]
+                outtemp["bw_mhz"] = freq_bw0[4]
+
+        case 3:
+            # 80+80 MHz (deprecated)
+            outtemp["bw_mhz"] = 160
+            freq_bw0 = wifi_helper.get_channel_from_num(
+                ctx["freq_code"], vht_op["channel_center_freq_0"])
+            freq_bw1 = wifi_helper.get_channel_from_num(
+                ctx["freq_code"], vht_op["channel_center_freq_1"])
+
+            # Check the second channel segment first
+            if (freq_bw1 is not None):
+                outtemp["center_freq1_mhz"] = freq_bw1[1]
+                outtemp["channel_num"] = freq_bw1[0]
+            if (freq_bw0 is not None):
+                outtemp["center_freq0_mhz"] = freq_bw0[1]
+                outtemp["channel_num"] = freq_bw0[0]
+
+
+def decode_vht_caps(outtemp, vht_caps, ctx):
+    outtemp["amendment"] = "11ac"
+    logging.debug(vht_caps)
+
+    # Max VHT AMPDU size
+    if ("max_a_mpdu_length_exponent" in vht_caps):
+        ctx["ampdu_exponent"] = vht_caps["max_a_mpdu_length_exponent"]
+        outtemp["vht_max_rx_ampdu_size_bytes"] = (
+            pow(2, 13 + vht_caps["max_a_mpdu_length_exponent"]) - 1)
+
+    # Max VHT RX and TX spatial stream
+    for mcs_set_key, out_key in [
+            ("supported_rx_mcs_set", "vht_max_rx_num_stream"),
+            ("supported_tx_mcs_set", "vht_max_tx_num_stream")]:
+        if (mcs_set_key in vht_caps):
+            num_stream = wifi_helper.get_max_num_stream(
+                vht_caps[mcs_set_key])
+            if (num_stream is not None):
+                outtemp[out_key] = num_stream
+
+
+def decode_he_op(outtemp, he_op, ctx):
+    outtemp["amendment"] = "11ax"
+    logging.debug(he_op)
+
+    if ("6ghz_info" in he_op):
+        # Attempt to resolve bandwidth for 6 GHz channels
+        # that does not have HT or VHT operation elements
+        freq_bw0 = wifi_helper.get_channel_from_num(
+            ctx["freq_code"],
+            he_op["6ghz_info"]["channel_center_freq_0"])
+        freq_bw1 = wifi_helper.get_channel_from_num(
+            ctx["freq_code"],
+            he_op["6ghz_info"]["channel_center_freq_1"])
+
+        if (freq_bw0 is not None and freq_bw1 is not None):
+            # This might be 160 or 80+80 MHz
+            outtemp["bw_mhz"] = 160
+            outtemp["center_freq0_mhz"] = freq_bw0[1]
+            outtemp["center_freq1_mhz"] = freq_bw1[1]
+            if (freq_bw1[4] == 80):
+                # Must be 80+80 MHz
+                # Use the first channel segment number,
+                # may change later
+                outtemp["channel_num"] = freq_bw0[0]
+            elif (freq_bw1[4] == 160):
+                # Must be 160 MHz
+                # Use the second channel segment number
+                outtemp["channel_num"] = freq_bw1[0]
+        elif (freq_bw0 is not None):
+            # This might be 40 or 80 MHz
+            outtemp["channel_num"] = freq_bw0[0]
+            outtemp["center_freq0_mhz"] = freq_bw0[1]
+            outtemp["bw_mhz"] = freq_bw0[4]
+
+        outtemp["6ghz_ap_type"] = (
+            "LPI" if he_op["6ghz_info"]["regulatory_info"] == 0
+            else "SP")
+
+    # TODO 6 GHz band caps
+
+
+def decode_he_caps(outtemp, he_caps, ctx):
+    outtemp["amendment"] = "11ax"
+    logging.debug(he_caps)
+
+    # HE AMPDU size extension
+    if ("maximum_a_mpdu_length_exponent_extension" in he_caps
+            and ctx["ampdu_exponent"]):
+        outtemp["he_max_rx_ampdu_size_extension_bytes"] = pow(
+            2,
+            (13 + ctx["ampdu_exponent"] + he_caps[
+                "maximum_a_mpdu_length_exponent_extension"])
+        ) - 1
+
+    bw_str = "20"
+    if ("channel_width_set" in he_caps):
+        if (he_caps["channel_width_set"] & 1 > 0):
+            bw_str = "40"
+        if (he_caps["channel_width_set"] & 2 > 0):
+            bw_str = "40/80"
+        if (he_caps["channel_width_set"] & 12 > 0):
+            bw_str = "160"
+
+    # Check current channel width and correct if necessary
+    if (str(outtemp["bw_mhz"]) not in bw_str):
+        # We pick 80 MHz for 40/80 since we should have picked 40
+        # in VHT or HE Operation
+        bw_mhz = 80 if bw_str == "40/80" else int(bw_str)
+        ch = wifi_helper.get_channel_from_freq(
+            outtemp["primary_freq_mhz"], bw_mhz)
+        if (ch is not None):
+            outtemp["channel_num"] = ch[0]
+            outtemp["center_freq0_mhz"] = ch[1]
+            outtemp["bw_mhz"] = bw_mhz
+
+    bw_key = "<=_80mhz"
+    if (bw_str == "160"):
+        bw_key = "160mhz"
+    # Max HE RX and TX spatial stream
+    for mcs_set_key, out_key in [
+            ("supported_rx_mcs_set_" + bw_key, "he_max_rx_num_stream"),
+            ("supported_tx_mcs_set_" + bw_key, "he_max_tx_num_stream")]:
+        if (mcs_set_key in he_caps):
+            num_stream = wifi_helper.get_max_num_stream(
+                he_caps[mcs_set_key])
+            if (num_stream is not None):
+                outtemp[out_key] = num_stream
+
+
+def decode_tpc_report(outtemp, tpc_element, ctx):
+    logging.debug(tpc_element)
+
+    outtemp["tx_power_dbm"] = tpc_element["tx_power"]
+    outtemp["link_margin_db"] = tpc_element["link_margin"]
+
+
+def decode_bss_load(outtemp, bss_load_element, ctx):
+    logging.debug(bss_load_element)
+
+    outtemp["sta_count"] = bss_load_element["sta_count"]
+    outtemp["ch_utilization"] = bss_load_element["ch_utilization"]
+    if ("available_admission_cap" in bss_load_element):
+        outtemp["available_admission_capacity_sec"] = bss_load_element[
+            "available_admission_cap"] * 32 / 1e6
+
+
+def decode_vendor_specific(outtemp, vendor_elements):
+    for elem in vendor_elements:
+        if (elem['oui'] == '506f9a'
+                and elem['oui_type'] == 28
+                and outtemp['ssid'] == ''
+                and 'ssid' in elem):
+            outtemp['ssid'] = elem['ssid']
+        elif (elem['oui'] == '000b86'
+                and elem['oui_type'] == 1
+                and 'ap_name' in elem):
+            outtemp['ap_name'] = elem['ap_name']
+
+
+# Beacon element handlers, in the order they are applied
+beacon_element_handlers = [
+    ("HT Operation", decode_ht_op),
+    ("HT Capabilities", decode_ht_caps),
+    ("VHT Operation", decode_vht_op),
+    ("VHT Capabilities", decode_vht_caps),
+    ("HE Operation", decode_he_op),
+    ("HE Capabilities", decode_he_caps),
+    ("TPC Report", decode_tpc_report),
+    ("BSS Load", decode_bss_load)
+]
+beacon_element_types = {elem_type for elem_type, _ in beacon_element_handlers}
 
 
 def get_scan_line(mac, json_dict):
@@ -361,79 +770,51 @@ def get_scan_line(mac, json_dict):
 
     # Process link
     links = {
-        "link_mean_rssi_dbm": "NaN",
-        "link_max_rssi_dbm": "NaN",
-        "link_min_rssi_dbm": "NaN",
-        "link_median_rssi_dbm": "NaN",
-        "link_25perc_rssi_dbm": "NaN",
-        "link_75perc_rssi_dbm": "NaN",
-        "link_mean_tx_bitrate_mbps": "NaN",
-        "link_max_tx_bitrate_mbps": "NaN",
-        "link_min_tx_bitrate_mbps": "NaN",
-        "link_median_tx_bitrate_mbps": "NaN",
-        "link_25perc_tx_bitrate_mbps": "NaN",
-        "link_75perc_tx_bitrate_mbps": "NaN",
-        "link_mean_rx_bitrate_mbps": "NaN",
-        "link_max_rx_bitrate_mbps": "NaN",
-        "link_min_rx_bitrate_mbps": "NaN",
-        "link_median_rx_bitrate_mbps": "NaN",
-        "link_25perc_rx_bitrate_mbps": "NaN",
-        "link_75perc_rx_bitrate_mbps": "NaN"
+        "link_mean_rssi_dbm": np.nan,
+        "link_max_rssi_dbm": np.nan,
+        "link_min_rssi_dbm": np.nan,
+        "link_median_rssi_dbm": np.nan,
+        "link_25perc_rssi_dbm": np.nan,
+        "link_75perc_rssi_dbm": np.nan,
+        "link_mean_tx_bitrate_mbps": np.nan,
+        "link_max_tx_bitrate_mbps": np.nan,
+        "link_min_tx_bitrate_mbps": np.nan,
+        "link_median_tx_bitrate_mbps": np.nan,
+        "link_25perc_tx_bitrate_mbps": np.nan,
+        "link_75perc_tx_bitrate_mbps": np.nan,
+        "link_mean_rx_bitrate_mbps": np.nan,
+        "link_max_rx_bitrate_mbps": np.nan,
+        "link_min_rx_bitrate_mbps": np.nan,
+        "link_median_rx_bitrate_mbps": np.nan,
+        "link_25perc_rx_bitrate_mbps": np.nan,
+        "link_75perc_rx_bitrate_mbps": np.nan
     }
     logging.debug("links in json_dict? %s", "links" in json_dict)
     if "links" in json_dict:
         logging.debug("rssi in json_dict? %s", "rssi" in json_dict["links"])
-        if len(json_dict["links"]) > 0 and "rssi" in json_dict["links"][0]:
-            rssi_dbm = [re_dbm.findall(val["rssi"])
-                        for val in json_dict["links"]]
-            rssi_dbm = np.array([int(val[0]) for val in rssi_dbm
-                                 if len(val) > 0])
-            if len(rssi_dbm) > 0:
-                links["link_mean_rssi_dbm"] = mw_to_dbm(np.nanmean(dbm_to_mw(
-                    rssi_dbm)))
-                links["link_max_rssi_dbm"] = int(np.max(rssi_dbm))
-                links["link_min_rssi_dbm"] = int(np.min(rssi_dbm))
-                links["link_median_rssi_dbm"] = np.nanmedian(rssi_dbm)
-                links["link_25perc_rssi_dbm"] = np.nanpercentile(rssi_dbm, 25)
-                links["link_75perc_rssi_dbm"] = np.nanpercentile(rssi_dbm, 75)
-
-        if (len(json_dict["links"]) > 0
-                and "tx_bitrate" in json_dict["links"][0]):
-            tx_bitrate_mbps = [re_mbps.findall(val["tx_bitrate"])
-                               for val in json_dict["links"]]
-            tx_bitrate_mbps = [float(val[0]) for val in tx_bitrate_mbps
-                               if len(val) > 0]
-            if len(tx_bitrate_mbps) > 0:
-                links["link_mean_tx_bitrate_mbps"] = np.nanmean(tx_bitrate_mbps)
-                links["link_max_tx_bitrate_mbps"] = int(
-                    np.max(tx_bitrate_mbps))
-                links["link_min_tx_bitrate_mbps"] = int(
-                    np.min(tx_bitrate_mbps))
-                links["link_median_tx_bitrate_mbps"] = np.nanmedian(
-                    tx_bitrate_mbps)
-                links["link_25perc_tx_bitrate_mbps"] = np.nanpercentile(
-                    tx_bitrate_mbps, 25)
-                links["link_75perc_tx_bitrate_mbps"] = np.nanpercentile(
-                    tx_bitrate_mbps, 75)
-
-        if (len(json_dict["links"]) > 0
-                and "rx_bitrate" in json_dict["links"][0]):
-            rx_bitrate_mbps = [re_mbps.findall(val["rx_bitrate"])
-                               for val in json_dict["links"]]
-            rx_bitrate_mbps = [float(val[0]) for val in rx_bitrate_mbps
-                               if len(val) > 0]
-            if len(rx_bitrate_mbps) > 0:
-                links["link_mean_rx_bitrate_mbps"] = np.nanmean(rx_bitrate_mbps)
-                links["link_max_rx_bitrate_mbps"] = int(
-                    np.max(rx_bitrate_mbps))
-                links["link_min_rx_bitrate_mbps"] = int(
-                    np.min(rx_bitrate_mbps))
-                links["link_median_rx_bitrate_mbps"] = np.nanmedian(
-                    rx_bitrate_mbps)
-                links["link_25perc_rx_bitrate_mbps"] = np.nanpercentile(
-                    rx_bitrate_mbps, 25)
-                links["link_75perc_rx_bitrate_mbps"] = np.nanpercentile(
-                    rx_bitrate_mbps, 75)
+        link_metrics = [("rssi", re_dbm, int, "rssi_dbm"),
+                        ("tx_bitrate", re_mbps, float, "tx_bitrate_mbps"),
+                        ("rx_bitrate", re_mbps, float, "rx_bitrate_mbps")]
+        for link_key, regex, convert, suffix in link_metrics:
+            if (len(json_dict["links"]) == 0
+                    or link_key not in json_dict["links"][0]):
+                continue
+            values = [regex.findall(val[link_key])
+                      for val in json_dict["links"]]
+            values = [convert(val[0]) for val in values if len(val) > 0]
+            if len(values) > 0:
+                link_stats = get_stats(values)
+                if (link_key == "rssi"):
+                    # Average RSSI in the linear domain
+                    links[f"link_mean_{suffix}"] = mw_to_dbm(np.nanmean(
+                        dbm_to_mw(np.array(values))))
+                else:
+                    links[f"link_mean_{suffix}"] = link_stats["mean"]
+                links[f"link_max_{suffix}"] = int(link_stats["max"])
+                links[f"link_min_{suffix}"] = int(link_stats["min"])
+                links[f"link_median_{suffix}"] = link_stats["median"]
+                links[f"link_25perc_{suffix}"] = link_stats["25perc"]
+                links[f"link_75perc_{suffix}"] = link_stats["75perc"]
     logging.debug("links: %s", links)
 
     # Print beacons
@@ -460,41 +841,41 @@ def get_scan_line(mac, json_dict):
             "amendment": "unknown",
             "connected": "unknown" if "connected" not in beacon
             else beacon["connected"],
-            "tx_power_dbm": "NaN",
-            "link_margin_db": "NaN",
-            "sta_count": "NaN",
-            "ch_utilization": "NaN",
-            "available_admission_capacity_sec": "NaN",
+            "tx_power_dbm": np.nan,
+            "link_margin_db": np.nan,
+            "sta_count": np.nan,
+            "ch_utilization": np.nan,
+            "available_admission_capacity_sec": np.nan,
             "ap_name": "unknown",
             "6ghz_ap_type": "unknown",
-            "ht_max_rx_ampdu_size_bytes": "NaN",
-            "ht_max_rx_num_stream": "NaN",
-            "ht_max_tx_num_stream": "NaN",
-            "vht_max_rx_ampdu_size_bytes": "NaN",
-            "vht_max_rx_num_stream": "NaN",
-            "vht_max_tx_num_stream": "NaN",
-            "he_6ghz_max_rx_ampdu_size_bytes": "NaN",
-            "he_max_rx_ampdu_size_extension_bytes": "NaN",
-            "he_max_rx_num_stream": "NaN",
-            "he_max_tx_num_stream": "NaN",
-            "link_mean_rssi_dbm": "NaN",
-            "link_max_rssi_dbm": "NaN",
-            "link_min_rssi_dbm": "NaN",
-            "link_median_rssi_dbm": "NaN",
-            "link_25perc_rssi_dbm": "NaN",
-            "link_75perc_rssi_dbm": "NaN",
-            "link_mean_tx_bitrate_mbps": "NaN",
-            "link_max_tx_bitrate_mbps": "NaN",
-            "link_min_tx_bitrate_mbps": "NaN",
-            "link_median_tx_bitrate_mbps": "NaN",
-            "link_25perc_tx_bitrate_mbps": "NaN",
-            "link_75perc_tx_bitrate_mbps": "NaN",
-            "link_mean_rx_bitrate_mbps": "NaN",
-            "link_max_rx_bitrate_mbps": "NaN",
-            "link_min_rx_bitrate_mbps": "NaN",
-            "link_median_rx_bitrate_mbps": "NaN",
-            "link_25perc_rx_bitrate_mbps": "NaN",
-            "link_75perc_rx_bitrate_mbps": "NaN"
+            "ht_max_rx_ampdu_size_bytes": np.nan,
+            "ht_max_rx_num_stream": np.nan,
+            "ht_max_tx_num_stream": np.nan,
+            "vht_max_rx_ampdu_size_bytes": np.nan,
+            "vht_max_rx_num_stream": np.nan,
+            "vht_max_tx_num_stream": np.nan,
+            "he_6ghz_max_rx_ampdu_size_bytes": np.nan,
+            "he_max_rx_ampdu_size_extension_bytes": np.nan,
+            "he_max_rx_num_stream": np.nan,
+            "he_max_tx_num_stream": np.nan,
+            "link_mean_rssi_dbm": np.nan,
+            "link_max_rssi_dbm": np.nan,
+            "link_min_rssi_dbm": np.nan,
+            "link_median_rssi_dbm": np.nan,
+            "link_25perc_rssi_dbm": np.nan,
+            "link_75perc_rssi_dbm": np.nan,
+            "link_mean_tx_bitrate_mbps": np.nan,
+            "link_max_tx_bitrate_mbps": np.nan,
+            "link_min_tx_bitrate_mbps": np.nan,
+            "link_median_tx_bitrate_mbps": np.nan,
+            "link_25perc_tx_bitrate_mbps": np.nan,
+            "link_75perc_tx_bitrate_mbps": np.nan,
+            "link_mean_rx_bitrate_mbps": np.nan,
+            "link_max_rx_bitrate_mbps": np.nan,
+            "link_min_rx_bitrate_mbps": np.nan,
+            "link_median_rx_bitrate_mbps": np.nan,
+            "link_25perc_rx_bitrate_mbps": np.nan,
+            "link_75perc_rx_bitrate_mbps": np.nan
         }
 
         # Only update "link_*" attributes if the current beacon is connected.
@@ -502,298 +883,32 @@ def get_scan_line(mac, json_dict):
             for key in links:
                 outtemp[key] = links[key]
 
-        # HT Operation and Capabilities
-        ht_op = [x for x in beacon["extras"]
-                      if x["type"] == "HT Operation"]
-        if (len(ht_op) > 0):
-            outtemp["amendment"] = "11n"
-            ht_op = ht_op[0]["elements"]
-            logging.debug(ht_op)
-
-            # Attempt to resolve bandwidth
-            if (ht_op["sta_channel_width"] == 1):
-                ch = wifi_helper.get_channel_from_freq(
-                    primary_freq, 40)
-                if (ch is not None):
-                    outtemp["channel_num"] = ch[0]
-                    outtemp["center_freq0_mhz"] = ch[1]
-                    outtemp["bw_mhz"] = 40
-
-        ampdu_exponent = 0
-        ht_caps = [x for x in beacon["extras"]
-                      if x["type"] == "HT Capabilities"]
-        if (len(ht_caps) > 0):
-            outtemp["amendment"] = "11n"
-            ht_caps = ht_caps[0]["elements"]
-            logging.debug(ht_caps)
-
-            # Max HT AMPDU size
-            if ("maximum_rx_a_mpdu_length" in ht_caps):
-                ampdu_exponent = ht_caps["maximum_rx_a_mpdu_length"]
-                outtemp["ht_max_rx_ampdu_size_bytes"] = (
-                    pow(2, 13 + ht_caps["maximum_rx_a_mpdu_length"]) - 1)
-
-            # Max HT RX spatial stream
-            if ("rx_mcs_bitmask" in ht_caps):
-                for i in range(4):
-                    mcs_mask = ht_caps["rx_mcs_bitmask"] & (255 << (8 * i))
-                    if (mcs_mask > 0):
-                        outtemp["ht_max_rx_num_stream"] = i + 1
-
-            # Max HT TX spatial stream
-            if ("tx_mcs_set_defined" in ht_caps
-                    and "tx_rx_mcs_set_not_equal" in ht_caps
-                    and ht_caps["tx_mcs_set_defined"] == 1):
-                if (ht_caps["tx_rx_mcs_set_not_equal"] == 0):
-                    outtemp["ht_max_tx_num_stream"] = outtemp[
-                        "ht_max_rx_num_stream"]
-                elif ("tx_max_ss_supported" in ht_caps):
-                    outtemp["ht_max_tx_num_stream"] = (
-                        ht_caps["tx_max_ss_supported"] + 1)
-
-        # VHT Operation and Capabilities
-        vht_op = [x for x in beacon["extras"]
-                       if x["type"] == "VHT Operation"]
-        if (len(vht_op) > 0):
-            outtemp["amendment"] = "11ac"
-            vht_op = vht_op[0]["elements"]
-            logging.debug(vht_op)
-
-            # Attempt to further resolve bandwidth > 40 MHz
-            match vht_op["channel_width"]:
-                case 0:
-                    # 20 or 40 MHz
-                    freq_bw0 = wifi_helper.get_channel_from_num(
-                        wifi_helper.get_freq_code(primary_freq),
-                        vht_op["channel_center_freq_0"])
-                    if (freq_bw0 is not None):
-                        outtemp["channel_num"] = freq_bw0[0]
-                        outtemp["center_freq0_mhz"] = freq_bw0[1]
-                        outtemp["bw_mhz"] = freq_bw0[4]
-
-                case 1:
-                    # 80 or 160 or 80+80 MHz
-                    freq_bw0 = wifi_helper.get_channel_from_num(
-                        wifi_helper.get_freq_code(primary_freq),
-                        vht_op["channel_center_freq_0"])
-                    freq_bw1 = wifi_helper.get_channel_from_num(
-                        wifi_helper.get_freq_code(primary_freq),
-                        vht_op["channel_center_freq_1"])
-
-                    if (freq_bw0 is not None and freq_bw1 is not None):
-                        # This might be 160 or 80+80 MHz
-                        outtemp["bw_mhz"] = 160
-                        outtemp["center_freq0_mhz"] = freq_bw0[1]
-                        outtemp["center_freq1_mhz"] = freq_bw1[1]
-                        if (freq_bw1[4] == 80):
-                            # Must be 80+80 MHz
-                            # Use the first channel segment number,
-                            # may change later
-                            outtemp["channel_num"] = freq_bw0[0]
-                        elif (freq_bw1[4] == 160):
-                            # Must be 160 MHz
-                            # Use the second channel segment number
-                            outtemp["channel_num"] = freq_bw1[0]
-                    elif (freq_bw0 is not None):
-                        # This must be 80 MHz
-                        outtemp["channel_num"] = freq_bw0[0]
-                        outtemp["center_freq0_mhz"] = freq_bw0[1]
-                        outtemp["bw_mhz"] = freq_bw0[4]
-                case 2:
-                    # 160 MHz (deprecated)
-                    freq_bw0 = wifi_helper.get_channel_from_num(
-                        wifi_helper.get_freq_code(primary_freq),
-                        vht_op["channel_center_freq_0"])
-                    if (freq_bw0 is not None):
-                        outtemp["channel_num"] = freq_bw0[0]
-                        outtemp["center_freq0_mhz"] = freq_bw0[1]
-                        outtemp["bw_mhz"] = freq_bw0[4]
-                case 3:
-                    # 80+80 MHz (deprecated)
-                    outtemp["bw_mhz"] = 160
-                    freq_bw0 = wifi_helper.get_channel_from_num(
-                        wifi_helper.get_freq_code(primary_freq),
-                        vht_op["channel_center_freq_0"])
-                    freq_bw1 = wifi_helper.get_channel_from_num(
-                        wifi_helper.get_freq_code(primary_freq),
-                        vht_op["channel_center_freq_1"])
-
-                    # Check the second channel segment first
-                    if (freq_bw1 is not None):
-                        outtemp["center_freq1_mhz"] = freq_bw1[1]
-                        outtemp["channel_num"] = freq_bw1[0]
-                    if (freq_bw0 is not None):
-                        outtemp["center_freq0_mhz"] = freq_bw0[1]
-                        outtemp["channel_num"] = freq_bw0[0]
-
-        vht_caps = [x for x in beacon["extras"]
-                       if x["type"] == "VHT Capabilities"]
-        if (len(vht_caps) > 0):
-            outtemp["amendment"] = "11ac"
-            vht_caps = vht_caps[0]["elements"]
-            logging.debug(vht_caps)
-
-            # Max VHT AMPDU size
-            if ("max_a_mpdu_length_exponent" in vht_caps):
-                ampdu_exponent = vht_caps["max_a_mpdu_length_exponent"]
-                outtemp["vht_max_rx_ampdu_size_bytes"] = (
-                    pow(2, 13 + vht_caps["max_a_mpdu_length_exponent"]) - 1)
-
-            # Max VHT RX spatial stream
-            if ("supported_rx_mcs_set" in vht_caps):
-                for i in range(8):
-                    mcs_mask = (
-                        (vht_caps["supported_rx_mcs_set"] >> (i * 2)) & 3)
-                    if (mcs_mask != 3):
-                        outtemp["vht_max_rx_num_stream"] = i + 1
-
-            # Max VHT TX spatial stream
-            if ("supported_tx_mcs_set" in vht_caps):
-                for i in range(8):
-                    mcs_mask = (
-                        (vht_caps["supported_tx_mcs_set"] >> (i * 2)) & 3)
-                    if (mcs_mask != 3):
-                        outtemp["vht_max_tx_num_stream"] = i + 1
-
-        # HE Operation and Capabilities
-        he_op = [x for x in beacon["extras"]
-                      if x["type"] == "HE Operation"]
-        if (len(he_op) > 0):
-            outtemp["amendment"] = "11ax"
-            he_op = he_op[0]["elements"]
-            logging.debug(he_op)
-
-            if ("6ghz_info" in he_op):
-                # Attempt to resolve bandwidth for 6 GHz channels
-                # that does not have HT or VHT operation elements
-                freq_bw0 = wifi_helper.get_channel_from_num(
-                    wifi_helper.get_freq_code(primary_freq),
-                    he_op["6ghz_info"]["channel_center_freq_0"])
-                freq_bw1 = wifi_helper.get_channel_from_num(
-                    wifi_helper.get_freq_code(primary_freq),
-                    he_op["6ghz_info"]["channel_center_freq_1"])
-
-                if (freq_bw0 is not None and freq_bw1 is not None):
-                    # This might be 160 or 80+80 MHz
-                    outtemp["bw_mhz"] = 160
-                    outtemp["center_freq0_mhz"] = freq_bw0[1]
-                    outtemp["center_freq1_mhz"] = freq_bw1[1]
-                    if (freq_bw1[4] == 80):
-                        # Must be 80+80 MHz
-                        # Use the first channel segment number,
-                        # may change later
-                        outtemp["channel_num"] = freq_bw0[0]
-                    elif (freq_bw1[4] == 160):
-                        # Must be 160 MHz
-                        # Use the second channel segment number
-                        outtemp["channel_num"] = freq_bw1[0]
-                elif (freq_bw0 is not None):
-                    # This might be 40 or 80 MHz
-                    outtemp["channel_num"] = freq_bw0[0]
-                    outtemp["center_freq0_mhz"] = freq_bw0[1]
-                    outtemp["bw_mhz"] = freq_bw0[4]
-
-                outtemp["6ghz_ap_type"] = (
-                    "LPI" if he_op["6ghz_info"]["regulatory_info"] == 0
-                    else "SP")
-
-        # TODO 6 GHz band caps
-
-        he_caps = [x for x in beacon["extras"]
-                      if x["type"] == "HE Capabilities"]
-        if (len(he_caps) > 0):
-            outtemp["amendment"] = "11ax"
-            he_caps = he_caps[0]["elements"]
-            logging.debug(he_caps)
-
-            # HE AMPDU size extension
-            if ("maximum_a_mpdu_length_exponent_extension" in he_caps
-                    and ampdu_exponent):
-                outtemp["he_max_rx_ampdu_size_extension_bytes"] = pow(
-                    2,
-                    (13 + ampdu_exponent + he_caps[
-                        "maximum_a_mpdu_length_exponent_extension"])
-                ) - 1
-
-            bw_str = "20"
-            if ("channel_width_set" in he_caps):
-                if (he_caps["channel_width_set"] & 1 > 0):
-                    bw_str = "40"
-                if (he_caps["channel_width_set"] & 2 > 0):
-                    bw_str = "40/80"
-                if (he_caps["channel_width_set"] & 12 > 0):
-                    bw_str = "160"
-
-            # Check current channel width and correct if necessary
-            if (str(outtemp["bw_mhz"]) not in bw_str):
-                # We pick 80 MHz for 40/80 since we should have picked 40
-                # in VHT or HE Operation
-                bw_mhz = 80 if bw_str == "40/80" else int(bw_str)
-                ch = wifi_helper.get_channel_from_freq(
-                    primary_freq, bw_mhz)
-                if (ch is not None):
-                    outtemp["channel_num"] = ch[0]
-                    outtemp["center_freq0_mhz"] = ch[1]
-                    outtemp["bw_mhz"] = bw_mhz
-
-            bw_key = "<=_80mhz"
-            if (bw_str == "160"):
-                bw_key = "160mhz"
-            # Max HE RX spatial stream
-            mcs_set_key = "supported_rx_mcs_set_" + bw_key
-            if (mcs_set_key in he_caps):
-                for i in range(8):
-                    mcs_mask = ((he_caps[mcs_set_key] >> (i * 2)) & 3)
-                    if (mcs_mask != 3):
-                        outtemp["he_max_rx_num_stream"] = i + 1
-
-            # Max HE TX spatial stream
-            mcs_set_key = "supported_tx_mcs_set_" + bw_key
-            if (mcs_set_key in he_caps):
-                for i in range(8):
-                    mcs_mask = ((he_caps[mcs_set_key] >> (i * 2)) & 3)
-                    if (mcs_mask != 3):
-                        outtemp["he_max_tx_num_stream"] = i + 1
-
-
-        tpc_element = [x for x in beacon["extras"]
-                       if x["type"] == "TPC Report"]
-        if (len(tpc_element) > 0):
-            tpc_element = tpc_element[0]["elements"]
-            logging.debug(tpc_element)
-
-            outtemp["tx_power_dbm"] = tpc_element["tx_power"]
-            outtemp["link_margin_db"] = tpc_element["link_margin"]
-
-        bss_load_element = [x for x in beacon["extras"]
-                            if x["type"] == "BSS Load"]
-        if (len(bss_load_element) > 0):
-            bss_load_element = bss_load_element[0]["elements"]
-            logging.debug(bss_load_element)
-
-            outtemp["sta_count"] = bss_load_element["sta_count"]
-            outtemp["ch_utilization"] = bss_load_element["ch_utilization"]
-            if ("available_admission_cap" in bss_load_element):
-                outtemp["available_admission_capacity_sec"] = bss_load_element[
-                    "available_admission_cap"] * 32 / 1e6
-
-        vendor_ies = [x for x in beacon["extras"]
-                     if x["type"] == "Vendor Specific"]
-        for elem in [ie['elements'] for ie in vendor_ies]:
-            if (elem['oui'] == '506f9a'
-                    and elem['oui_type'] == 28
-                    and outtemp['ssid'] == ''
-                    and 'ssid' in elem):
-                outtemp['ssid'] = elem['ssid']
-            elif (elem['oui'] == '000b86'
-                    and elem['oui_type'] == 1
-                    and 'ap_name' in elem):
-                outtemp['ap_name'] = elem['ap_name']
+        # Index beacon elements by type in one pass, only the first element
+        # of each type is used except for vendor specific elements. Other
+        # types are not decoded and may come without elements.
+        elements = dict()
+        vendor_elements = list()
+        for extra in beacon["extras"]:
+            if (extra["type"] == "Vendor Specific"):
+                vendor_elements.append(extra["elements"])
+            elif (extra["type"] in beacon_element_types
+                    and extra["type"] not in elements):
+                elements[extra["type"]] = extra["elements"]
+
+        ctx = {
+            "freq_code": wifi_helper.get_freq_code(primary_freq),
+            "ampdu_exponent": 0
+        }
+        for elem_type, handler in beacon_element_handlers:
+            if elem_type in elements:
+                handler(outtemp, elements[elem_type], ctx)
+        if (len(vendor_elements) > 0):
+            decode_vendor_specific(outtemp, vendor_elements)
 
         logging.debug(outtemp)
         # Only add to list if we got bandwidth resolved
         if (outtemp["bw_mhz"] != 0):
-            outlist.append(outtemp)
+            outlist.append(ScanLine.from_dict(outtemp))
 
     return outlist
 
@@ -809,70 +924,238 @@ def get_line(mode, mac, json_dict):
             return get_scan_line(mac, json_dict)
 
 
-def write(outarr, args):
-    if (args.json):
-        args.output_file.write(json.dumps(outarr))
+class ScanColumns:
+    """Columnar storage of wifi_scan lines.
+
+    Numeric columns are kept in typed arrays with NaN for missing values,
+    instead of one record of boxed values per beacon.
+    """
+
+    def __init__(self):
+        self.columns = dict()
+        for key, dtype in ScanLine.dtypes.items():
+            match dtype:
+                case "int64":
+                    self.columns[key] = array("q")
+                case "Int64" | "float64":
+                    self.columns[key] = array("d")
+                case _:
+                    self.columns[key] = list()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, lines):
+        for i, column in enumerate(self.columns.values()):
+            column.extend(line[i] for line in lines)
+        self.size += len(lines)
+
+    def iter_lines(self):
+        # Convert back to the same records get_scan_line outputs
+        converters = [
+            (lambda x: x if np.isnan(x) else int(x)) if dtype == "Int64"
+            else None
+            for dtype in ScanLine.dtypes.values()]
+        for values in zip(*self.columns.values()):
+            yield ScanLine(
+                value if convert is None else convert(value)
+                for convert, value in zip(converters, values))
+
+    def to_frame(self):
+        # Int64 columns are float64 with NaN here, they are converted by
+        # write_csv.to_frame like the columns of a list of lines.
+        out_dict = dict()
+        for key, column in self.columns.items():
+            match ScanLine.dtypes[key]:
+                case "int64":
+                    out_dict[key] = np.frombuffer(column, dtype=np.int64)
+                case "Int64" | "float64":
+                    out_dict[key] = np.frombuffer(column, dtype=np.float64)
+                case _:
+                    out_dict[key] = column
+        return pd.DataFrame(out_dict, copy=False)
+
+
+def to_frame(lines, mode):
+    # DataFrame of the lines of mode with the memory types of
+    # table_schema, Int64 columns keep their integers when there are
+    # missing values. Lines stored in a ScanColumns or in a list go through
+    # the same conversions, so both give the same values and dtypes.
+    line_type = line_types[mode]
+    if isinstance(lines, ScanColumns):
+        df = lines.to_frame()
+    else:
+        df = pd.DataFrame.from_records(lines, columns=line_type.columns)
+    df = df.astype({key: "Int64"
+                    for key, dtype in line_type.dtypes.items()
+                    if dtype == "Int64"})
+    return table_schema.to_memory_types(df, mode)
+
+
+def get_fieldnames(mode):
+    # CSV columns of mode
+    fieldnames = []
+    match mode:
+        case "throughput":
+            fieldnames += ["timestamp", "mac", "test_uuid", "type",
+                           "direction", "interface", "host", "isp",
+                           "duration_s", "transfered_mbytes", "tput_mbps",
+                           "std_tput_mbps", "max_tput_mbps",
+                           "min_tput_mbps", "median_tput_mbps",
+                           "25perc_tput_mbps", "75perc_tput_mbps"]
+        case "latency":
+            fieldnames += ["timestamp", "mac", "test_uuid", "type",
+                           "interface", "host", "isp", "latency_ms",
+                           "jitter_ms", "min_latency_ms", "max_latency_ms",
+                           "median_latency_ms", "25perc_latency_ms",
+                           "75perc_latency_ms"]
+        case "wifi_scan":
+            fieldnames += ["timestamp", "mac", "test_uuid", "corr_test",
+                           "interface", "bssid", "ssid", "ap_name",
+                           "rssi_dbm",
+                           "primary_channel_num", "primary_freq_mhz",
+                           "channel_num", "center_freq0_mhz",
+                           "center_freq1_mhz", "bw_mhz", "amendment",
+                           "connected", "tx_power_dbm", "link_margin_db",
+                           "sta_count", "ch_utilization",
+                           "available_admission_capacity_sec",
+                           "ap_name", "6ghz_ap_type",
+                           "ht_max_rx_ampdu_size_bytes",
+                           "ht_max_rx_num_stream",
+                           "ht_max_tx_num_stream",
+                           "vht_max_rx_ampdu_size_bytes",
+                           "vht_max_rx_num_stream",
+                           "vht_max_tx_num_stream",
+                           "he_6ghz_max_rx_ampdu_size_bytes",
+                           "he_max_rx_ampdu_size_extension_bytes",
+                           "he_max_rx_num_stream",
+                           "he_max_tx_num_stream",
+                           "link_mean_rssi_dbm", "link_max_rssi_dbm",
+                           "link_min_rssi_dbm", "link_median_rssi_dbm",
+                           "link_25perc_rssi_dbm",
+                           "link_75perc_rssi_dbm",
+                           "link_mean_tx_bitrate_mbps",
+                           "link_max_tx_bitrate_mbps",
+                           "link_min_tx_bitrate_mbps",
+                           "link_median_tx_bitrate_mbps",
+                           "link_25perc_tx_bitrate_mbps",
+                           "link_75perc_tx_bitrate_mbps",
+                           "link_mean_rx_bitrate_mbps",
+                           "link_max_rx_bitrate_mbps",
+                           "link_min_rx_bitrate_mbps",
+                           "link_median_rx_bitrate_mbps",
+                           "link_25perc_rx_bitrate_mbps",
+                           "link_75perc_rx_bitrate_mbps"]
+    return fieldnames
+
+
+def write_parquet(outarr, mode, output_file):
+    if isinstance(outarr, ScanColumns):
+        frames = [outarr.to_frame()]
     else:
-        fieldnames = []
-        match args.mode:
-            case "throughput":
-                fieldnames += ["timestamp", "mac", "test_uuid", "type",
-                               "direction", "interface", "host", "isp",
-                               "duration_s", "transfered_mbytes", "tput_mbps",
-                               "std_tput_mbps", "max_tput_mbps",
-                               "min_tput_mbps", "median_tput_mbps",
-                               "25perc_tput_mbps", "75perc_tput_mbps"]
-            case "latency":
-                fieldnames += ["timestamp", "mac", "test_uuid", "type",
-                               "interface", "host", "isp", "latency_ms",
-                               "jitter_ms", "min_latency_ms", "max_latency_ms",
-                               "median_latency_ms", "25perc_latency_ms",
-                               "75perc_latency_ms"]
-            case "wifi_scan":
-                fieldnames += ["timestamp", "mac", "test_uuid", "corr_test",
-                               "interface", "bssid", "ssid", "ap_name",
-                               "rssi_dbm",
-                               "primary_channel_num", "primary_freq_mhz",
-                               "channel_num", "center_freq0_mhz",
-                               "center_freq1_mhz", "bw_mhz", "amendment",
-                               "connected", "tx_power_dbm", "link_margin_db",
-                               "sta_count", "ch_utilization",
-                               "available_admission_capacity_sec",
-                               "ap_name", "6ghz_ap_type",
-                               "ht_max_rx_ampdu_size_bytes",
-                               "ht_max_rx_num_stream",
-                               "ht_max_tx_num_stream",
-                               "vht_max_rx_ampdu_size_bytes",
-                               "vht_max_rx_num_stream",
-                               "vht_max_tx_num_stream",
-                               "he_6ghz_max_rx_ampdu_size_bytes",
-                               "he_max_rx_ampdu_size_extension_bytes",
-                               "he_max_rx_num_stream",
-                               "he_max_tx_num_stream",
-                               "link_mean_rssi_dbm", "link_max_rssi_dbm",
-                               "link_min_rssi_dbm", "link_median_rssi_dbm",
-                               "link_25perc_rssi_dbm",
-                               "link_75perc_rssi_dbm",
-                               "link_mean_tx_bitrate_mbps",
-                               "link_max_tx_bitrate_mbps",
-                               "link_min_tx_bitrate_mbps",
-                               "link_median_tx_bitrate_mbps",
-                               "link_25perc_tx_bitrate_mbps",
-                               "link_75perc_tx_bitrate_mbps",
-                               "link_mean_rx_bitrate_mbps",
-                               "link_max_rx_bitrate_mbps",
-                               "link_min_rx_bitrate_mbps",
-                               "link_median_rx_bitrate_mbps",
-                               "link_25perc_rx_bitrate_mbps",
-                               "link_75perc_rx_bitrate_mbps"]
+        frames = table_schema.iter_frames(outarr, line_types[mode].columns)
+    table_schema.write_parquet(frames, mode, output_file)
 
+
+def write_text(outarr, mode, files):
+    # Write lines to text files of each {fmt: file} of files ("csv", "json"
+    # or "ndjson") in a single pass, each line is only converted once.
+    if isinstance(outarr, ScanColumns):
+        outarr = outarr.iter_lines()
+    csv_writer = None
+    if "csv" in files:
         csv_writer = csv.DictWriter(
-            args.output_file, fieldnames=fieldnames)
+            files["csv"], fieldnames=get_fieldnames(mode))
         csv_writer.writeheader()
-        csv_writer.writerows(outarr)
+    if "json" in files:
+        # Write line by line, output is the same as json.dumps of a list
+        files["json"].write("[")
+    is_json = "json" in files or "ndjson" in files
+
+    for i, line in enumerate(outarr):
+        line = line.to_dict()
+        if is_json:
+            text = json.dumps(line)
+            if "json" in files:
+                files["json"].write(text if i == 0 else ", " + text)
+            if "ndjson" in files:
+                files["ndjson"].write(text + "\n")
+        if csv_writer is not None:
+            csv_writer.writerow(line)
+
+    if "json" in files:
+        files["json"].write("]")
+
+
+def write_files(outarr, mode, outputs):
+    # Write lines of mode to each {fmt: path} of outputs. Text formats are
+    # written together in one pass over the lines while Parquet is written
+    # in another thread.
+    text_outputs = {fmt: path for fmt, path in outputs.items()
+                    if fmt != "parquet"}
+    if ("parquet" in outputs and len(text_outputs) > 0
+            and not isinstance(outarr, (list, ScanColumns))):
+        # Lines are read twice
+        outarr = list(outarr)
+
+    with ThreadPoolExecutor(1) as executor:
+        future = None
+        if "parquet" in outputs:
+            future = executor.submit(
+                write_parquet, outarr, mode, outputs["parquet"])
+        with ExitStack() as stack:
+            write_text(outarr, mode, {
+                fmt: stack.enter_context(open(path, "w"))
+                for fmt, path in text_outputs.items()})
+        if future is not None:
+            future.result()
 
 
-def read_logs(args):
+def write(outarr, args):
+    # outarr is either a list of lines, a ScanColumns, or an iterable of
+    # lines (e.g. from iter_logs) which is written line by line.
+    fmt = table_schema.get_format(args)
+    if (fmt == "parquet"):
+        write_parquet(outarr, args.mode, args.output_file)
+    else:
+        write_text(outarr, args.mode, {fmt: args.output_file})
+
+
+def append(outarr, mode, path):
+    # Append lines to a CSV, JSON or Parquet file of mode previously written
+    # by write, the output is the same as writing all lines at once.
+    if isinstance(outarr, ScanColumns):
+        outarr = outarr.iter_lines()
+    match path.suffix:
+        case ".csv":
+            with open(path, "a") as fd:
+                csv_writer = csv.DictWriter(
+                    fd, fieldnames=get_fieldnames(mode))
+                csv_writer.writerows(line.to_dict() for line in outarr)
+        case ".json":
+            # Replace the closing bracket of the JSON list
+            with open(path, "r+b") as fd:
+                fd.seek(-1, 2)
+                for line in outarr:
+                    fd.write(", {}".format(
+                        json.dumps(line.to_dict())).encode())
+                fd.write(b"]")
+        case ".parquet":
+            table_schema.append_parquet(
+                table_schema.iter_frames(outarr, line_types[mode].columns),
+                mode, path)
+
+
+# Log directories read by each mode, matched against the file path
+mode_dirs = {
+    "throughput": ["iperf-log", "speedtest-log"],
+    "latency": ["iperf-log", "ping-log", "speedtest-log"],
+    "wifi_scan": ["wifi-scan"]
+}
+
+
+def list_files(args):
     if (args.mac):
         logging.info(args.mac)
         files = []
@@ -882,65 +1165,362 @@ def read_logs(args):
     else:
         files = [path for path in args.log_dir.rglob("*") if path.is_file()]
 
-    match args.mode:
-        case "throughput":
-            files = list(filter(lambda x: ("iperf-log" in str(x)
-                                           or "speedtest-log" in str(x)),
-                                files))
-        case "latency":
-            files = list(filter(lambda x: ("iperf-log" in str(x)
-                                           or "ping-log" in str(x)
-                                           or "speedtest-log" in str(x)),
-                                files))
-        case "wifi_scan":
-            files = list(filter(lambda x: "wifi-scan" in str(x), files))
-        case _:
-            logging.warning("Unknown mode: %s", args.mode)
-
+    # Read files in a fixed order so the order of the lines does not depend
+    # on the file system
+    files.sort(key=get_file_order)
     logging.debug(files)
-
-    outarr = list()
+    return files
+
+
+def get_file_order(path):
+    # Log file names start with the date of the test, so files are read by
+    # date across log directories, ties are broken by the full path
+    return (path.name, path)
+
+
+def is_file_pass(args, file):
+    # Log file names start with the local ISO date of the test. Allow one
+    # day of slack on both ends to account for the timezone, exact bounds
+    # are checked per line in is_line_pass.
+    if (args.newer_than_ns is not None
+            and file.stat().st_mtime_ns <= args.newer_than_ns):
+        return False
+    file_date = re_file_date.findall(file.name)
+    if (len(file_date) == 0):
+        return True
+    try:
+        file_date = datetime.fromisoformat(file_date[0]).date()
+    except ValueError:
+        return True
+    is_pass = ((args.start_time is None)
+               or ((args.start_time - timedelta(days=1)).date()
+                   <= file_date))
+    is_pass = is_pass and (
+        (args.end_time is None)
+        or (file_date <= (args.end_time + timedelta(days=1)).date()))
+    return is_pass
+
+
+def is_line_pass(args, line):
     wlan1_dt_threshold = datetime.fromisoformat("2024-08-16T00:00-0400")
-
-    for file in files:
-        logging.info("Reading %s", file)
-        with open(file) as fd:
-            json_dict = dict()
+    curr_time = datetime.fromisoformat(line["timestamp"])
+    is_pass = ((args.start_time is None)
+               or (args.start_time < curr_time))
+    is_pass = is_pass and (
+        (args.end_time is None)
+        or (args.end_time > curr_time))
+    # Check if interface == wlan1, then only allow data after
+    # date threshold.
+    is_pass = is_pass and (
+        (line["interface"] != "wlan1")
+        or (curr_time > wlan1_dt_threshold))
+    return is_pass
+
+
+# Version of the cached lines, bump parser_version when get_tput_line,
+# get_lat_line or get_scan_line change the lines they output. Changes of the
+# table columns are covered by the hash of the line schemas.
+parser_version = 1
+cache_version = "{}-{}".format(parser_version, hashlib.sha1(json.dumps(
+    {mode: line_type.dtypes for mode, line_type in line_types.items()}
+).encode()).hexdigest())
+
+
+def open_cache(cache_file):
+    # Parsed lines are cached per file and mode as lists of values, keyed by
+    # the file path and invalidated when the file size or mtime changes.
+    # Lines of another cache version are all dropped.
+    conn = sqlite3.connect(cache_file, timeout=600)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Check the version in a write transaction, so only one process sharing
+    # the cache file drops the old lines
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(("CREATE TABLE IF NOT EXISTS line_values ("
+                  "path TEXT, mode TEXT, size INTEGER, mtime_ns INTEGER, "
+                  "lines TEXT, PRIMARY KEY (path, mode))"))
+    conn.execute(("CREATE TABLE IF NOT EXISTS cache_info ("
+                  "key TEXT PRIMARY KEY, value TEXT)"))
+    row = conn.execute(
+        "SELECT value FROM cache_info WHERE key='version'").fetchone()
+    if (row is None or row[0] != cache_version):
+        logging.info("Parse cache %s is outdated, clearing it", cache_file)
+        conn.execute("DELETE FROM line_values")
+        conn.execute("INSERT OR REPLACE INTO cache_info VALUES ('version', ?)",
+                     (cache_version,))
+    conn.commit()
+    return conn
+
+
+def get_cache_prefixes(args):
+    # Path prefixes of the cached files under the directories read by args
+    directories = ([args.log_dir.joinpath(mac) for mac in args.mac]
+                   if args.mac else [args.log_dir])
+    return [os.path.join(str(directory), "") for directory in directories]
+
+
+def prune_cache(conn, args):
+    # Drop the lines of deleted files under the directories read by args
+    deleted = list()
+    for prefix in get_cache_prefixes(args):
+        deleted += [row for row in conn.execute(
+            ("SELECT DISTINCT path FROM line_values "
+             "WHERE substr(path, 1, ?) = ?"),
+            (len(prefix), prefix)) if not Path(row[0]).is_file()]
+    if (len(deleted) > 0):
+        logging.info("Removing %d deleted files from the parse cache",
+                     len(deleted))
+        conn.executemany("DELETE FROM line_values WHERE path=?", deleted)
+        conn.commit()
+
+
+def read_cache(conn, file, stat, modes):
+    cached = dict()
+    for mode in modes:
+        row = conn.execute(
+            ("SELECT size, mtime_ns, lines FROM line_values "
+             "WHERE path=? AND mode=?"),
+            (str(file), mode)).fetchone()
+        if (row is not None
+                and row[0] == stat.st_size
+                and row[1] == stat.st_mtime_ns):
+            cached[mode] = [line_types[mode](values)
+                            for values in json.loads(row[2])]
+    return cached
+
+
+def read_cache_stamps(conn, args):
+    # (size, mtime_ns) of the cached lines of each (path, mode) under the
+    # directories read by args, with one query per directory
+    stamps = dict()
+    for prefix in get_cache_prefixes(args):
+        for path, mode, size, mtime_ns in conn.execute(
+                ("SELECT path, mode, size, mtime_ns FROM line_values "
+                 "WHERE substr(path, 1, ?) = ?"),
+                (len(prefix), prefix)):
+            stamps[(path, mode)] = (size, mtime_ns)
+    return stamps
+
+
+def write_cache(conn, entries):
+    # Write all new entries in one short transaction, so parallel processes
+    # sharing the cache file do not wait on each other while parsing.
+    conn.executemany(
+        "INSERT OR REPLACE INTO line_values VALUES (?, ?, ?, ?, ?)", entries)
+    conn.commit()
+
+
+def flush_cache(conn, entries):
+    # Write and clear the new entries, if a cache is used
+    if (conn is None or len(entries) == 0):
+        return
+    logging.info("Caching %d new entries", len(entries))
+    write_cache(conn, entries)
+    entries.clear()
+
+
+def read_files(cache_conn, tasks, refresh=False):
+    # Yield the lines of each (file, modes) task, loaded from the cache if
+    # the file is unchanged, together with the new cache entries and the
+    # number of bytes read from the file (None if it was not read). If
+    # refresh is set, all files are parsed again and their entries replaced.
+    for file, file_modes in tasks:
+        lines = dict()
+        cache_entries = list()
+        num_bytes = None
+        stat = file.stat()
+        if (cache_conn is not None and not refresh):
+            lines = read_cache(cache_conn, file, stat, file_modes)
+
+        if (len(lines) < len(file_modes)):
+            logging.info("Reading %s", file)
+            num_bytes = stat.st_size
+            json_dict = None
             try:
-                json_dict = json.load(fd)
+                json_dict = json_helper.load_file(file)
             except Exception as err:
                 logging.debug("Cannot parse file %s as JSON, reason=%s",
                               file, err)
-            else:
-                curr_line = get_line(
-                    args.mode,
-                    file.parts[1],
-                    json_dict)
-                if (len(curr_line) > 0):
-                    curr_time = datetime.fromisoformat(
-                        curr_line[0]["timestamp"])
-                    is_pass = ((args.start_time is None)
-                               or (args.start_time < curr_time))
-                    is_pass = is_pass and (
-                        (args.end_time is None)
-                        or (args.end_time > curr_time))
-                    # Check if interface == wlan1, then only allow data after
-                    # date threshold.
-                    is_pass = is_pass and (
-                        (curr_line[0]["interface"] != "wlan1")
-                        or (curr_time > wlan1_dt_threshold))
-                    if is_pass:
-                        outarr += curr_line
 
+            for mode in file_modes:
+                if mode in lines:
+                    continue
+                lines[mode] = (list() if json_dict is None
+                               else get_line(mode, file.parts[1], json_dict))
+                if cache_conn is not None:
+                    cache_entries.append((
+                        str(file), mode, stat.st_size, stat.st_mtime_ns,
+                        json.dumps(lines[mode])))
+
+        yield lines, cache_entries, num_bytes
+
+
+# Most files read by one pool task; with at most two tasks per process in
+# flight, this bounds the parsed lines held in memory in parallel mode
+max_chunk_files = 64
+# Most new cache entries held in memory before they are written
+max_cache_entries = 256
+
+
+def read_chunk(cache_file, refresh, tasks):
+    # Pool worker, reads a chunk of files with its own cache connection
+    cache_conn = None
+    if cache_file:
+        cache_conn = open_cache(cache_file)
+    outarr = list(read_files(cache_conn, tasks, refresh))
+    if cache_conn is not None:
+        cache_conn.close()
     return outarr
 
 
+def imap_bounded(pool, fun, items, max_pending):
+    # Like Pool.imap, but submit at most max_pending items ahead of the
+    # consumer, so finished results do not pile up in memory while it lags
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(fun, (item,)))
+        if (len(pending) >= max_pending):
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def get_file_tasks(args, modes):
+    # (file, modes) of each file to read and the modes reading it
+    tasks = list()
+    for file in list_files(args):
+        file_modes = [mode for mode in modes
+                      if any(log_dir in str(file)
+                             for log_dir in mode_dirs[mode])]
+        if (len(file_modes) > 0 and is_file_pass(args, file)):
+            tasks.append((file, file_modes))
+    return tasks
+
+
+def cache_logs(args, tasks):
+    # Parse the files of the (file, modes) tasks, e.g. a stripe of the
+    # output of get_file_tasks, that are not in args.cache_file yet and
+    # cache their lines without keeping them. Several processes can share
+    # the files of a directory this way.
+    cache_conn = open_cache(args.cache_file)
+    stamps = (dict() if args.refresh_cache
+              else read_cache_stamps(cache_conn, args))
+    new_tasks = list()
+    for file, file_modes in tasks:
+        stat = file.stat()
+        file_modes = [mode for mode in file_modes
+                      if stamps.get((str(file), mode))
+                      != (stat.st_size, stat.st_mtime_ns)]
+        if (len(file_modes) > 0):
+            new_tasks.append((file, file_modes))
+
+    cache_entries = list()
+    try:
+        # The cache was checked above, parse all new_tasks
+        for _, entries, num_bytes in read_files(cache_conn, new_tasks,
+                                                refresh=True):
+            cache_entries.extend(entries)
+            stage_stats.count("files_read")
+            stage_stats.count("bytes_read", num_bytes)
+            if (len(cache_entries) >= max_cache_entries):
+                flush_cache(cache_conn, cache_entries)
+    finally:
+        # Keep the files parsed so far if parsing fails
+        flush_cache(cache_conn, cache_entries)
+        cache_conn.close()
+
+
+def iter_logs_multi(args, modes):
+    # Walk the log directory and parse each file once, then yield the
+    # (mode, lines) of every requested mode that reads the file, in order.
+    for mode in modes:
+        if mode not in mode_dirs:
+            logging.warning("Unknown mode: %s", mode)
+    modes = [mode for mode in modes if mode in mode_dirs]
+    tasks = get_file_tasks(args, modes)
+    cache_conn = None
+    if args.cache_file:
+        cache_conn = open_cache(args.cache_file)
+        prune_cache(cache_conn, args)
+
+    cache_entries = list()
+
+    def collect(results):
+        # Results are in the same order as tasks
+        for (file, file_modes), (lines, entries, num_bytes) in zip(
+                tasks, results):
+            cache_entries.extend(entries)
+            if (len(cache_entries) >= max_cache_entries):
+                flush_cache(cache_conn, cache_entries)
+            if num_bytes is not None:
+                stage_stats.count("files_read")
+                stage_stats.count("bytes_read", num_bytes)
+            else:
+                stage_stats.count("files_cached")
+            for mode in file_modes:
+                curr_line = lines[mode]
+                if (len(curr_line) > 0
+                        and is_line_pass(args, curr_line[0])):
+                    yield mode, curr_line
+
+    try:
+        if (args.num_parallel > 1 and len(tasks) > 1):
+            # Split files into a few chunks per process to balance the load,
+            # capped so a chunk of lines stays small however many files
+            # there are
+            chunk_size = min(math.ceil(len(tasks) / (args.num_parallel * 4)),
+                             max_chunk_files)
+            chunks = [tasks[i:i + chunk_size]
+                      for i in range(0, len(tasks), chunk_size)]
+            logging.info("Reading %d files in %d chunks with %d processes",
+                         len(tasks), len(chunks), args.num_parallel)
+            with Pool(args.num_parallel) as p:
+                yield from collect(chain.from_iterable(imap_bounded(
+                    p, partial(read_chunk, args.cache_file,
+                               args.refresh_cache),
+                    chunks, args.num_parallel * 2)))
+        else:
+            yield from collect(
+                read_files(cache_conn, tasks, args.refresh_cache))
+    finally:
+        # Also keep the files parsed so far if the consumer stops early or
+        # fails
+        if cache_conn is not None:
+            flush_cache(cache_conn, cache_entries)
+            cache_conn.close()
+
+
+def iter_logs(args):
+    # Stream the lines of args.mode without keeping them in memory
+    for mode, lines in iter_logs_multi(args, [args.mode]):
+        yield from lines
+
+
+def read_logs_multi(args, modes, columnar=False):
+    # Read lines for each mode. If columnar is set, wifi_scan lines are
+    # collected in a ScanColumns instead of a list.
+    outarrs = {mode: (ScanColumns() if columnar and mode == "wifi_scan"
+                      else list())
+               for mode in modes if mode in mode_dirs}
+    for mode, lines in iter_logs_multi(args, modes):
+        outarrs[mode].extend(lines)
+
+    return outarrs
+
+
+def read_logs(args):
+    return read_logs_multi(args, [args.mode]).get(args.mode, list())
+
+
 def parse(list_args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("mode", choices=["throughput", "latency", "wifi_scan"],
                         help="Choose type of CSV files.'")
     parser.add_argument("-J", "--json", action="store_true",
                         help="Output as JSON.")
+    parser.add_argument("-N", "--ndjson", action="store_true",
+                        help="Output as newline-delimited JSON.")
+    parser.add_argument("-P", "--parquet", action="store_true",
+                        help="Output as Parquet.")
     parser.add_argument("-m", "--mac", nargs='+',
                         help="Filter data to the speficied MAC address.")
     parser.add_argument("--start-time", nargs='?',
@@ -951,11 +1531,23 @@ def parse(list_args=None):
                         type=(lambda x: datetime.fromisoformat(x)),
                         help=("Filter data to the speficied end time (must "
                               "be in ISO format, ex: 2024-06-14T17:00-0500)"))
+    parser.add_argument("--newer-than-ns", type=int,
+                        help=("Only read files modified after the specified "
+                              "time, in nanoseconds since epoch"))
     parser.add_argument("-o", "--output-file", nargs='?',
                         type=argparse.FileType('w'), default=sys.stdout,
                         help="Output result to file, default is to stdout'")
     parser.add_argument("-d", "--log-dir", type=Path, default=Path("./logs"),
                         help="Specify local log directory, default='./logs'")
+    parser.add_argument("-p", "--num-parallel", type=int, default=1,
+                        help=("Specify number of parallel processes to parse "
+                              "files, default=1"))
+    parser.add_argument("--cache-file", type=Path,
+                        help=("Cache parsed lines in the specified SQLite "
+                              "file, only new or changed logs are parsed."))
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help=("Parse all logs again and replace their lines "
+                              "in the cache file."))
     parser.add_argument("-l", "--log-level", default="warning",
                         help="Provide logging level, default is warning'")
     if (list_args is None):
@@ -969,6 +1561,6 @@ if __name__ == '__main__':
     args = parse()
     logging.basicConfig(level=args.log_level.upper())
 
-    outarr = read_logs(args)
-    write(outarr, args)
+    # Stream lines from the logs to the output file
+    write(iter_logs(args), args)
     print("Done!")